@@ -0,0 +1,152 @@
+import os
+import threading
+
+from flask import g, jsonify, request
+
+
+class RouteLimiter:
+    """Bounded in-flight limit for one route, with a bounded wait queue"""
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def acquire(self):
+        """Take a slot, waiting at most queue_timeout; False means shed the request"""
+        if self._slots.acquire(blocking=False):
+            return self._admitted()
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.shed += 1
+                return False
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        got_slot = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.queued -= 1
+            if not got_slot:
+                self.shed += 1
+                return False
+        return self._admitted()
+
+    def _admitted(self):
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            total = self.admitted + self.shed
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "shed_rate": round(self.shed / total, 3) if total else 0.0
+            }
+
+
+class AdmissionController:
+    """Per-route admission control for a Flask app.
+
+    Each limited route gets at most max_in_flight concurrent requests; extra
+    requests wait up to queue_timeout seconds in a queue of at most max_queue
+    and are otherwise rejected at once with 503 and Retry-After, instead of
+    tying up a worker thread until the client gives up. Routes that are not
+    listed (health checks, history reads) are never queued behind the slow
+    LLM-backed ones.
+    """
+
+    def __init__(self, routes, max_in_flight=8, max_queue=16, queue_timeout=2.0, retry_after=5):
+        self.retry_after = retry_after
+        self.limiters = {route: RouteLimiter(max_in_flight, max_queue, queue_timeout) for route in routes}
+
+    def install(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        return self
+
+    def _before_request(self):
+        limiter = self.limiters.get(request.path)
+        if limiter is None:
+            return None
+        if not limiter.acquire():
+            response = jsonify({"error": "Server is busy, please retry shortly"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(self.retry_after)
+            return response
+        g.admission_limiter = limiter
+        return None
+
+    def _teardown_request(self, exc):
+        limiter = g.pop("admission_limiter", None)
+        if limiter is not None:
+            limiter.release()
+
+    def stats(self):
+        return {route: limiter.stats() for route, limiter in self.limiters.items()}
+
+
+def admission_from_env(routes):
+    return AdmissionController(
+        routes,
+        max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "16")),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2")),
+        retry_after=int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "5"))
+    )
+
+
+if __name__ == "__main__":
+    # Load generator against a slow stub LLM route: 64 concurrent clients hit
+    # /slow (1s "LLM" call) while a poller checks /health stays fast.
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from flask import Flask
+
+    stub = Flask(__name__)
+
+    @stub.route("/slow")
+    def slow():
+        time.sleep(1.0)
+        return jsonify({"ok": True})
+
+    @stub.route("/health")
+    def health():
+        return jsonify({"status": "ok"})
+
+    controller = AdmissionController(["/slow"], max_in_flight=8, max_queue=16, queue_timeout=0.5).install(stub)
+
+    def call(path):
+        started = time.perf_counter()
+        status = stub.test_client().get(path).status_code
+        return status, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=72) as pool:
+        slow_calls = [pool.submit(call, "/slow") for _ in range(64)]
+        time.sleep(0.1)
+        health_calls = [pool.submit(call, "/health") for _ in range(8)]
+        slow_results = [f.result() for f in slow_calls]
+        health_results = [f.result() for f in health_calls]
+
+    ok = [t for status, t in slow_results if status == 200]
+    shed = [t for status, t in slow_results if status == 503]
+    print(f"/slow: {len(ok)} served (max {max(ok):.2f}s), {len(shed)} shed (max {max(shed, default=0):.3f}s)")
+    print(f"/health: max {max(t for _, t in health_results) * 1000:.1f} ms")
+    print(controller.stats())
@@ -6,17 +6,29 @@ import re
 import traceback
 import logging
 import glob
+import hmac
+import time
 from crewai import Agent, Task, Crew, LLM
 from dotenv import load_dotenv
-from textwrap import dedent
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
+from prompt_templates import register_template
+from question_bank import QuestionBank
+from tiered_generation import TieredGenerator
+from llm_calls import kickoff_crew
+from usage_accounting import QuotaExceeded, usage_accountant
+from firestore_repo import runner, users
+from llm_cassette import install_http_recorder, note_parse
+from admission import admission_from_env
+from idempotency import idempotent
+from compression import compression_from_env
+from stats_routes import install_stats_routes
+from etags import VersionCounter, conditional_get
 
 if not firebase_admin._apps:
     cred = credentials.Certificate(r"D:\python-projects\Cognitive_final_repo\cognitive-agent\cogbot-5f913-firebase-adminsdk-fbsvc-0d09449f5b.json")
     firebase_admin.initialize_app(cred) 
 
-db = firestore.client()
 
 
 
@@ -39,7 +51,17 @@ if not GROQ_API_KEY:
     logger.error("GROQ_API_KEY not set in environment variables")
     raise ValueError("GROQ_API_KEY not set")
 
-groq_llm = LLM(model="groq/gemma2-9b-it", temperature=0.7, api_key=GROQ_API_KEY)
+GROQ_MODEL = "groq/gemma2-9b-it"
+groq_llm = LLM(model=GROQ_MODEL, temperature=0.7, api_key=GROQ_API_KEY)
+
+# JSON schema of the final assessment, shared by the agent prompt and the final task
+ASSESSMENT_SCHEMA = """{
+  "working_memory": {"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"},
+  "attention_control": {"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"},
+  "learning_style": {"type": "<visual/auditory/kinesthetic>", "explanation": "<brief evidence-based rationale>"},
+  "planning_orientation": {"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"},
+  "decision_making": {"type": "<intuitive/analytical>", "explanation": "<brief evidence-based rationale>"}
+}"""
 
 assessment_prompt = """
 You are a cognitive assessment expert specializing in dynamic questioning. Your goal is to evaluate a user's cognitive traits through an adaptive interview process.
@@ -60,13 +82,7 @@ IMPORTANT RESPONSE FORMAT RULES:
 - Generic follow-up questions are not acceptable.
 
 After the 5th question, provide a comprehensive cognitive profile in this JSON format:
-{
-  "working_memory": {"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"},
-  "attention_control": {"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"},
-  "learning_style": {"type": "<visual/auditory/kinesthetic>", "explanation": "<brief evidence-based rationale>"},
-  "planning_orientation": {"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"},
-  "decision_making": {"type": "<intuitive/analytical>", "explanation": "<brief evidence-based rationale>"}
-}
+""" + ASSESSMENT_SCHEMA + """
 
 Only provide the final JSON after all 5 questions have been answered. Do not provide partial assessments earlier.
 """
@@ -89,13 +105,159 @@ classifier_agent = Agent(
     llm=groq_llm
 )
 
+# Task prompts are compiled once; the static instructions come first and stay
+# byte-identical between calls so the provider can cache the prompt prefix.
+NEXT_QUESTION_TEMPLATE = register_template(
+    "next_question",
+    static="""
+        Generate the next most relevant and personalized question for the user, based on the conversation history below.
+
+        IMPORTANT: Your response must ONLY contain the text of your next question, with no JSON wrapping,
+        no cognitive trait analysis, no explanations or commentary.
+
+        The question should directly reference content from their previous answer.
+    """,
+    dynamic="""
+        Conversation history:
+        {history}
+
+        This is question #{question_number}.
+    """
+)
+
+FINAL_ASSESSMENT_TEMPLATE = register_template(
+    "final_assessment",
+    static="The user has completed all 5 questions. Provide ONLY the final cognitive assessment in this JSON format:\n"
+           + ASSESSMENT_SCHEMA,
+    dynamic="""
+        Conversation history:
+        {history}
+    """
+)
+
+CLASSIFICATION_TEMPLATE = register_template(
+    "classification",
+    static="""
+        You are given a cognitive assessment result in JSON format.
+        Analyze the scores and descriptions for:
+        - Working memory
+        - Attention control
+        - Learning style
+        - Planning orientation
+        - Decision making
+
+        Then classify the user into ONE of the following cognitive profiles:
+        - Methodical Thinker
+        - Adaptive Learner
+        - Strategic Planner
+        - Analytical Problem Solver
+        - Experimental Explorer
+
+        Provide a classification label and a short rationale.
+
+        OUTPUT FORMAT:
+        Classification: <Profile Name>
+        Rationale: <Why this profile fits based on traits>
+    """,
+    dynamic="""
+        INPUT:
+        {assessment_json}
+    """
+)
+
+# Follow-up questions come from the pre-generated bank when the best match
+# clears BANK_SIMILARITY_THRESHOLD. Otherwise the LLM is asked, with the bank
+# as fallback when it errors out or misses the latency budget.
+LLM_LATENCY_BUDGET_SECONDS = float(os.getenv("LLM_LATENCY_BUDGET_SECONDS", "8"))
+BANK_SIMILARITY_THRESHOLD = float(os.getenv("BANK_SIMILARITY_THRESHOLD", "0.15"))
+# Estimated completion size of a generated question, for savings reports
+QUESTION_COMPLETION_TOKENS = 40
+question_bank = QuestionBank()
+question_generator = TieredGenerator(latency_budget=LLM_LATENCY_BUDGET_SECONDS)
+
 app = Flask(__name__)
+usage_accountant.start_flusher(int(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "30")))
+install_http_recorder(app)
+# LLM-backed routes get bounded concurrency and fast 503s when saturated;
+# cheap reads like health checks and history are left unlimited.
+admission = admission_from_env(["/next-question", "/profile"]).install(app)
+# Large JSON bodies (final assessment, history) are gzip/brotli compressed
+compressor = compression_from_env().install(app)
 
 # Improved conversation storage structure
 # Format: {user_id: {"conversations": [{"question": "...", "response": "..."}, ...], "timestamp": datetime}}
 conversation_history = {}
-
-def get_next_question(conversation_history_list):
+# Bumped on every change to a user's session; read endpoints use it as their ETag
+session_versions = VersionCounter()
+
+# LLM call labels for usage accounting, cassettes and hedging. The final
+# assessment and classification calls run much longer than question
+# generation, so they get their own labels instead of sharing its latency window.
+FINAL_ASSESSMENT_ROUTE = "/next-question/final-assessment"
+CLASSIFICATION_ROUTE = "/next-question/classification"
+
+def run_assessment_task(task_description, user_id=None, route="/next-question"):
+    """Run a single assessment task through the LLM and return the cleaned text"""
+    assessment_task = Task(
+        description=task_description,
+        agent=assessment_agent,
+        expected_output="Either a plain text question OR a JSON assessment"
+    )
+    
+    assessment_crew = Crew(
+        agents=[assessment_agent],
+        tasks=[assessment_task],
+        verbose=True
+    )
+
+    logger.info("Starting crew kickoff to generate next question")
+    result = kickoff_crew(assessment_crew, route, user_id, GROQ_MODEL, task_description)
+    
+    # Improved result handling
+    if hasattr(result, 'output'):
+        result_str = result.output
+    elif isinstance(result, dict):
+        result_str = json.dumps(result)
+    else:
+        result_str = str(result)
+    
+    logger.info(f"Raw result: {result_str[:200]}...")
+    
+    # Clean and return the result
+    result_str = result_str.strip()
+    if result_str.startswith('"') and result_str.endswith('"'):
+        result_str = result_str[1:-1]
+    
+    return result_str
+
+def split_history(conversation_history_list):
+    """Return (questions, answers) from the formatted Q/A history list"""
+    questions = [msg.split(": ", 1)[-1] for msg in conversation_history_list if msg.startswith("Q")]
+    answers = [msg.split(": ", 1)[-1] for msg in conversation_history_list if msg.startswith("A")]
+    return questions, answers
+
+def estimate_generation_savings(generation_log):
+    """Estimate the LLM tokens and latency saved by bank-served questions"""
+    bank_questions = sum(1 for tier in generation_log if tier == "question_bank")
+    llm_questions = sum(1 for tier in generation_log if tier == "llm")
+    template = NEXT_QUESTION_TEMPLATE.stats()
+    tokens_per_call = template["avg_total_tokens"] or template["static_tokens"]
+    llm_p50_ms = question_generator.metrics("llm").snapshot()["p50_latency_ms"]
+    return {
+        "bank_questions": bank_questions,
+        "llm_questions": llm_questions,
+        "estimated_tokens_saved": round(bank_questions * (tokens_per_call + QUESTION_COMPLETION_TOKENS)),
+        "estimated_latency_saved_ms": round(bank_questions * llm_p50_ms) if llm_p50_ms is not None else None
+    }
+
+def get_next_question(conversation_history_list, generation_log=None, user_id=None):
+    """Return the next question, or the final assessment JSON after 5 answers.
+
+    generation_log, when given, gets the name of the tier that produced each
+    question so per-assessment savings can be reported. LLM usage is
+    accounted against user_id; a user over quota still gets bank questions,
+    and QuotaExceeded is raised only when an LLM call is unavoidable.
+    """
     try:
         logger.info(f"Generating next question based on history: {conversation_history_list}")
         
@@ -105,70 +267,75 @@ def get_next_question(conversation_history_list):
         
         # Determine if we need to generate a final assessment
         if answer_count >= 5:
-            task_description = f"""
-            Based on this conversation history:
-            {conversation_history_list}
-            
-            The user has completed all 5 questions. Provide ONLY the final cognitive assessment in this JSON format:
-            {{
-              "working_memory": {{"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"}},
-              "attention_control": {{"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"}},
-              "learning_style": {{"type": "<visual/auditory/kinesthetic>", "explanation": "<brief evidence-based rationale>"}},
-              "planning_orientation": {{"score": <int 1-10>, "level": "<low/moderate/high>", "explanation": "<brief evidence-based rationale>"}},
-              "decision_making": {{"type": "<intuitive/analytical>", "explanation": "<brief evidence-based rationale>"}}
-            }}
-            """
-        else:
-            task_description = f"""
-            Based on this conversation history:
-            {conversation_history_list}
-            
-            Generate the next most relevant and personalized question (question #{answer_count + 1}).
-            
-            IMPORTANT: Your response must ONLY contain the text of your next question, with no JSON wrapping,
-            no cognitive trait analysis, no explanations or commentary.
-            
-            The question should directly reference content from their previous answer.
-            """
-
-        assessment_task = Task(
-            description=task_description,
-            agent=assessment_agent,
-            expected_output="Either a plain text question OR a JSON assessment"
-        )
-        
-        assessment_crew = Crew(
-            agents=[assessment_agent],
-            tasks=[assessment_task],
-            verbose=True
+            quota_error = usage_accountant.check_quota(user_id)
+            if quota_error:
+                raise QuotaExceeded(quota_error)
+            task_description = FINAL_ASSESSMENT_TEMPLATE.render(history=conversation_history_list)
+            return run_assessment_task(task_description, user_id, FINAL_ASSESSMENT_ROUTE)
+
+        questions, answers = split_history(conversation_history_list)
+
+        # Serve a pre-generated follow-up when one matches the last answer
+        # closely enough; only fall through to the LLM otherwise.
+        started = time.perf_counter()
+        asked_dimensions = [question_bank.dimension_of(q) for q in questions]
+        selection = question_bank.select(answers[-1] if answers else "", questions, asked_dimensions)
+        if selection is not None and selection[2] >= BANK_SIMILARITY_THRESHOLD:
+            question, dimension, score = selection
+            question_generator.metrics("question_bank").record("ok", time.perf_counter() - started, score)
+            logger.info(f"Question bank picked a {dimension} question (similarity {score:.2f})")
+            if generation_log is not None:
+                generation_log.append("question_bank")
+            return question
+
+        quota_error = usage_accountant.check_quota(user_id)
+        if quota_error:
+            if selection is None:
+                raise QuotaExceeded(quota_error)
+            question, dimension, score = selection
+            logger.info(f"User {user_id} is over quota, serving a {dimension} bank question (similarity {score:.2f})")
+            if generation_log is not None:
+                generation_log.append("question_bank")
+            return question
+
+        task_description = NEXT_QUESTION_TEMPLATE.render(
+            history=conversation_history_list,
+            question_number=answer_count + 1
         )
 
-        logger.info("Starting crew kickoff to generate next question")
-        result = assessment_crew.kickoff()
-        
-        # Improved result handling
-        if hasattr(result, 'output'):
-            result_str = result.output
-        elif isinstance(result, dict):
-            result_str = json.dumps(result)
-        else:
-            result_str = str(result)
-        
-        logger.info(f"Raw result: {result_str[:200]}...")
-        
-        # Clean and return the result
-        result_str = result_str.strip()
-        if result_str.startswith('"') and result_str.endswith('"'):
-            result_str = result_str[1:-1]
-        
-        return result_str
-        
+        def llm_tier():
+            question = run_assessment_task(task_description, user_id)
+            # A usable question is plain text, not JSON or an empty reply
+            usable = question and not question.startswith("{")
+            note_parse("/next-question", usable)
+            # There is no relevance score for a generated question
+            return (question if usable else None), None
+
+        def question_bank_tier():
+            if selection is None:
+                raise LookupError("Question bank exhausted")
+            question, dimension, score = selection
+            logger.info(f"Falling back to a {dimension} bank question (similarity {score:.2f})")
+            return question, score
+
+        question, tier = question_generator.generate([
+            ("llm", llm_tier),
+            ("question_bank", question_bank_tier)
+        ])
+        if tier != "llm":
+            logger.warning(f"Primary LLM unavailable, served question from tier '{tier}'")
+        if generation_log is not None:
+            generation_log.append(tier)
+        return question
+        
+    except QuotaExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error in get_next_question: {str(e)}")
         logger.error(traceback.format_exc())
         return "Error generating question. Please try again."
 
-def classify_assessment(assessment_data):
+def classify_assessment(assessment_data, user_id=None, route=CLASSIFICATION_ROUTE):
     """
     Improved classification function with robust parsing and error handling
     """
@@ -185,31 +352,9 @@ def classify_assessment(assessment_data):
             assessment_json = assessment_data
         
         # Prepare the classification task
-        task_description = dedent(f"""
-            You are given a cognitive assessment result in JSON format.
-            Analyze the scores and descriptions for:
-            - Working memory
-            - Attention control
-            - Learning style
-            - Planning orientation
-            - Decision making
-
-            Then classify the user into ONE of the following cognitive profiles:
-            - Methodical Thinker
-            - Adaptive Learner
-            - Strategic Planner
-            - Analytical Problem Solver
-            - Experimental Explorer
-
-            Provide a classification label and a short rationale.
-
-            INPUT:
-            {json.dumps(assessment_json, indent=2)}
-
-            OUTPUT FORMAT:
-            Classification: <Profile Name>
-            Rationale: <Why this profile fits based on traits>
-        """)
+        task_description = CLASSIFICATION_TEMPLATE.render(
+            assessment_json=json.dumps(assessment_json, indent=2)
+        )
         
         classifier_task = Task(
             description=task_description,
@@ -224,7 +369,7 @@ def classify_assessment(assessment_data):
         )
         
         logger.info("Starting classifier crew kickoff")
-        result = classifier_crew.kickoff()
+        result = kickoff_crew(classifier_crew, route, user_id, GROQ_MODEL, task_description)
         
         # Handle different result formats
         if hasattr(result, 'output'):
@@ -252,6 +397,7 @@ def classify_assessment(assessment_data):
             if rationale_match:
                 classification_result["rationale"] = rationale_match.group(1).strip()
         
+        note_parse(route, classification_result["profile"] != "Unknown")
         logger.info(f"Final parsed classification: {classification_result}")
         return classification_result
         
@@ -306,6 +452,7 @@ def parse_assessment_data(assessment_str):
         return None
 
 @app.route("/next-question", methods=["GET"])
+@idempotent
 def api_get_next_question():
     try:
         logger.info(f"Received next-question request: {request.args}")
@@ -322,6 +469,7 @@ def api_get_next_question():
                 "conversations": [],
                 "timestamp": datetime.now()
             }
+            session_versions.bump(user_id)
         
         user_data = conversation_history[user_id]
         
@@ -341,31 +489,41 @@ def api_get_next_question():
                 "question": first_question,
                 "response": None
             })
+            session_versions.bump(user_id)
             return jsonify({"next_question": first_question})
         
         # Get next question or final assessment
         logger.info("Getting next question based on conversation history")
-        result = get_next_question(formatted_history)
+        try:
+            result = get_next_question(formatted_history, user_data.setdefault("generation_log", []), user_id)
+        except QuotaExceeded as e:
+            logger.warning(f"Quota exceeded for user {user_id}: {e}")
+            return jsonify({"error": str(e)}), 429
         logger.info(f"Got result: {result[:100]}...")  # Log first 100 chars
         
         # Check if this is the final assessment
         if result.strip().startswith("{") and any(term in result for term in ["working_memory", "attention_control", "learning_style"]):
             logger.info("Result appears to be final assessment")
             parsed = parse_assessment_data(result)
+            note_parse(FINAL_ASSESSMENT_ROUTE, parsed)
             if parsed:
                 # Get classification for the assessment
                 logger.info("Parsed assessment data, getting classification")
-                classification = classify_assessment(parsed)
+                classification = classify_assessment(parsed, user_id)
                 
                 # Store assessment and classification
                 user_data["assessment"] = parsed
                 user_data["classification"] = classification
                 user_data["assessment_timestamp"] = datetime.now()
+                session_versions.bump(user_id)
                 
+                savings = estimate_generation_savings(user_data.get("generation_log", []))
+                logger.info(f"Question generation savings for user {user_id}: {savings}")
                 response_data = {
                     "assessment": parsed,
                     "classification": classification,
                     "conversation_history": user_data["conversations"],
+                    "generation_savings": savings,
                     "is_final": True
                 }
                 logger.info(f"Returning final assessment: {json.dumps(response_data)[:100]}...")
@@ -375,6 +533,7 @@ def api_get_next_question():
                 logger.warning("Failed to parse assessment data, returning raw result")
                 user_data["assessment"] = result
                 user_data["assessment_timestamp"] = datetime.now()
+                session_versions.bump(user_id)
                 return jsonify({
                     "assessment": result,
                     "conversation_history": user_data["conversations"],
@@ -387,6 +546,7 @@ def api_get_next_question():
             "question": result,
             "response": None
         })
+        session_versions.bump(user_id)
         
         return jsonify({"next_question": result})
     
@@ -396,6 +556,7 @@ def api_get_next_question():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/submit-response", methods=["POST"])
+@idempotent
 def submit_response():
     try:
         logger.info(f"Received submit-response request: {request.json}")
@@ -419,6 +580,7 @@ def submit_response():
         for conversation in reversed(user_data["conversations"]):
             if conversation["response"] is None:
                 conversation["response"] = user_response
+                session_versions.bump(user_id)
                 question_found = True
                 break
         
@@ -452,6 +614,7 @@ def submit_response():
         }), 500
 
 @app.route("/get-conversation-history", methods=["GET"])
+@conditional_get(lambda: session_versions.etag(request.args.get("user_id")))
 def get_conversation_history():
     try:
         logger.info(f"Received get-conversation-history request: {request.args}")
@@ -483,7 +646,16 @@ def get_conversation_history():
         logger.error(traceback.format_exc())
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+def profile_etag():
+    """Session ETag, but only once there is a real classification; until then /profile retries it"""
+    user_id = request.args.get("user_id")
+    classification = conversation_history.get(user_id, {}).get("classification")
+    if not classification or classification.get("profile") == "Unknown":
+        return None
+    return session_versions.etag(user_id)
+
 @app.route("/profile", methods=["GET"])
+@conditional_get(profile_etag)
 def get_profile():
     try:
         logger.info(f"Received profile request: {request.args}")
@@ -503,10 +675,15 @@ def get_profile():
            user_data["classification"].get("profile") == "Unknown":
             logger.info(f"No classification found for user {user_id}, checking for assessment")
             if "assessment" in user_data and user_data["assessment"]:
+                quota_error = usage_accountant.check_quota(user_id)
+                if quota_error:
+                    logger.warning(f"Quota exceeded for user {user_id}: {quota_error}")
+                    return jsonify({"error": quota_error}), 429
                 logger.info(f"Generating classification for user {user_id}")
                 # We have an assessment but no classification, generate it now
-                classification = classify_assessment(user_data["assessment"])
+                classification = classify_assessment(user_data["assessment"], user_id, "/profile")
                 user_data["classification"] = classification
+                session_versions.bump(user_id)
                 logger.info(f"Generated classification: {classification}")
                 
                 return jsonify({
@@ -612,13 +789,35 @@ def save_assessment():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/health", methods=["GET"])
+@conditional_get(session_versions.global_etag)
 def health_check():
-    """Simple health check endpoint to verify the API is working"""
+    """Simple health check endpoint to verify the API is working.
+
+    The body only changes when a session does, so it can carry an ETag;
+    last_session_change replaces the per-call timestamp a 304 would serve stale.
+    """
     return jsonify({
         "status": "ok",
-        "timestamp": datetime.now().isoformat(),
+        "last_session_change": session_versions.last_change.isoformat(),
         "active_users": len(conversation_history)
     })
+
+install_stats_routes(app, admission, compressor, {"/generation-stats": question_generator.stats})
+
+@app.route("/admin/usage", methods=["GET"])
+def admin_usage():
+    """Top LLM consumers for a day, by tokens"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), admin_token.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        limit = int(request.args.get("limit", 10))
+        return jsonify({"top_consumers": usage_accountant.top_consumers(limit, request.args.get("day"))})
+    except Exception as e:
+        logger.error(f"Error in admin_usage: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 @app.route("/save-assessment-firebase", methods=["GET"])
 def save_assessment_firebase():
     try:
@@ -661,8 +860,7 @@ def save_assessment_firebase():
 
         try:
             # Write cognitive_profile to Firestore under users/{user_id}
-            user_ref = db.collection("users").document(user_id)
-            user_ref.set({"cognitive_profile": cognitive_profile}, merge=True)
+            runner.run(users.save_cognitive_profile(user_id, cognitive_profile))
 
             logger.info(f"✅ Cognitive profile and classification stored for user {user_id}")
             return jsonify({"message": "Cognitive profile and classification saved to Firebase"}), 200
@@ -695,6 +893,7 @@ def clear_history():
         else:
             # Clear the conversation history for the user
             del conversation_history[user_id]
+            session_versions.forget(user_id)
             logger.info(f"Cleared conversation history for user {user_id}")
             return jsonify({"message": "Conversation history cleared successfully"}), 200
     except Exception as e:
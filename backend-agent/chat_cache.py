@@ -0,0 +1,50 @@
+import os
+import sys
+
+from lru_cache import LRUCache
+
+# Rough per-message overhead of the dict and its two keys, on top of the text
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+def _transcript_bytes(entry):
+    return sum(len(m.get("content", "")) + MESSAGE_OVERHEAD_BYTES for m in entry["messages"]) + sys.getsizeof(entry)
+
+
+class ChatCache:
+    """Write-through cache of active chat transcripts.
+
+    /learn populates an entry when it creates the chat document and /chat
+    replaces it with the full transcript after each successful write. Each entry remembers the
+    document's update_time from the last write or read. Writes are made with
+    that time as a precondition, so if another worker changed the chat in the
+    meantime the write fails and the entry is dropped instead of serving a
+    stale transcript.
+    """
+
+    def __init__(self, max_entries=2048, max_bytes=128 * 1024 * 1024):
+        self._cache = LRUCache(max_entries, max_bytes, sizeof=_transcript_bytes)
+
+    def _key(self, user_id, chat_id):
+        return f"{user_id}/{chat_id}"
+
+    def get(self, user_id, chat_id):
+        """Return (messages, update_time) or None"""
+        entry = self._cache.get(self._key(user_id, chat_id))
+        if entry is None:
+            return None
+        return list(entry["messages"]), entry["update_time"]
+
+    def put(self, user_id, chat_id, messages, update_time):
+        self._cache.put(self._key(user_id, chat_id), {"messages": list(messages), "update_time": update_time})
+
+    def invalidate(self, user_id, chat_id):
+        self._cache.pop(self._key(user_id, chat_id))
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["avg_bytes_per_chat"] = round(stats["bytes"] / stats["entries"]) if stats["entries"] else 0
+        return stats
+
+
+chat_cache = ChatCache(max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "2048")))
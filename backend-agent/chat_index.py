@@ -0,0 +1,268 @@
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from lru_cache import LRUCache
+from prompt_templates import estimate_tokens
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "for", "from",
+    "how", "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "so", "that",
+    "the", "this", "to", "was", "what", "when", "which", "why", "with", "you", "your"
+}
+# Long AI explanations are split so a match pulls in the relevant part only
+CHUNK_WORDS = 120
+# Approximate memory per stored chunk and per posting, for the size bounds
+DOC_OVERHEAD_BYTES = 1200
+POSTING_BYTES = 30
+
+
+def tokenize(text):
+    return [word for word in _WORD_RE.findall(text.lower()) if word not in STOPWORDS]
+
+
+def chunk_text(text, size=CHUNK_WORDS):
+    words = text.split()
+    if len(words) <= size:
+        return [text]
+    return [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+
+
+class BM25Index:
+    """Incremental BM25 index over one user's chat messages.
+
+    Documents are message chunks identified by (chat_id, position), where
+    position is the message's index in its chat. Adding a message only
+    touches the postings of its own terms, so the index can be kept current
+    as /learn and /chat write messages. bytes is an estimate of the memory
+    the index holds.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.docs = []
+        self.total_length = 0
+        self.bytes = 0
+        self._next_position = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add_message(self, chat_id, role, text):
+        with self._lock:
+            position = self._next_position[chat_id]
+            self._next_position[chat_id] += 1
+            for chunk in chunk_text(text or ""):
+                terms = tokenize(chunk)
+                doc_id = len(self.docs)
+                self.docs.append({"chat_id": chat_id, "position": position, "role": role,
+                                  "text": chunk, "length": len(terms)})
+                self.total_length += len(terms)
+                counts = defaultdict(int)
+                for term in terms:
+                    counts[term] += 1
+                for term, tf in counts.items():
+                    self.postings[term][doc_id] = tf
+                self.bytes += len(chunk) + DOC_OVERHEAD_BYTES + POSTING_BYTES * len(counts)
+
+    def add_chat(self, chat_id, messages):
+        for message in messages:
+            self.add_message(chat_id, message.get("role", ""), message.get("content", ""))
+
+    def search(self, query, k=5, exclude=()):
+        """Top-k docs for the query, skipping (chat_id, position) pairs in exclude"""
+        with self._lock:
+            total = len(self.docs)
+            if not total:
+                return []
+            average_length = self.total_length / total or 1
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    length_norm = 1 - self.b + self.b * self.docs[doc_id]["length"] / average_length
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+            exclude = set(exclude)
+            results = []
+            for doc_id, score in heapq.nlargest(k + len(exclude), scores.items(), key=lambda item: item[1]):
+                doc = self.docs[doc_id]
+                if (doc["chat_id"], doc["position"]) in exclude:
+                    continue
+                results.append(dict(doc, score=score))
+                if len(results) == k:
+                    break
+            return results
+
+    def __len__(self):
+        return len(self.docs)
+
+
+class ChatIndexRegistry:
+    """Per-user BM25 indexes, built in the background and kept in an LRU.
+
+    The LRU is bounded by total estimated bytes as well as by user count, and
+    a single user's index stops growing at max_user_bytes. A request never
+    waits for a build: get() returns None until the user's index is ready,
+    and the caller goes on without retrieval. A failed build is not retried
+    for retry_after seconds.
+    """
+
+    def __init__(self, max_users=256, max_bytes=256 * 1024 * 1024, max_user_bytes=32 * 1024 * 1024,
+                 retry_after=60):
+        self.max_user_bytes = max_user_bytes
+        self.retry_after = retry_after
+        self._indexes = LRUCache(max_users, max_bytes, sizeof=lambda index: index.bytes)
+        self._failed_at = LRUCache(max_users)
+        self._building = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-index")
+        self.builds = 0
+        self.build_failures = 0
+
+    def get(self, user_id, load_chats):
+        """The user's index, or None after scheduling a build from load_chats() -> [(chat_id, messages)]"""
+        index = self._indexes.get(user_id)
+        if index is not None:
+            return index
+        failed_at = self._failed_at.peek(user_id)
+        if failed_at is not None and time.monotonic() - failed_at < self.retry_after:
+            return None
+        with self._lock:
+            if user_id in self._building:
+                return None
+            self._building.add(user_id)
+        self._pool.submit(self._build, user_id, load_chats)
+        return None
+
+    def _build(self, user_id, load_chats):
+        try:
+            index = BM25Index()
+            for chat_id, messages in load_chats():
+                if index.bytes >= self.max_user_bytes:
+                    break
+                index.add_chat(chat_id, messages)
+            self._indexes.put(user_id, index)
+            with self._lock:
+                self.builds += 1
+        except Exception as e:
+            self._failed_at.put(user_id, time.monotonic())
+            with self._lock:
+                self.build_failures += 1
+            print(f"Error building chat index for {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(user_id)
+
+    def add_chat(self, user_id, chat_id, messages):
+        """Add messages to the user's index if it is loaded, and re-account its size"""
+        index = self._indexes.peek(user_id)
+        if index is None or index.bytes >= self.max_user_bytes:
+            return
+        index.add_chat(chat_id, messages)
+        self._indexes.put(user_id, index)
+
+    def stats(self):
+        stats = self._indexes.stats()
+        with self._lock:
+            stats.update(building=len(self._building), builds=self.builds, build_failures=self.build_failures)
+        return stats
+
+
+def build_chat_context(index, chat_id, messages, user_message, token_budget, recent_messages=6, top_k=8):
+    """Assemble the /chat prompt within token_budget.
+
+    Keeps the chat's system message and its most recent turns, then fills the
+    rest of the budget with the best-matching snippets from all of the user's
+    chats instead of pasting the whole transcript.
+    """
+    system = [m for m in messages[:1] if m.get("role") == "system"]
+    recent_start = max(len(system), len(messages) - recent_messages)
+    tail = f"\nUser: {user_message}\nAI:"
+    used = estimate_tokens(tail)
+
+    current = []
+    for message in system:
+        line = f"\n{message['role'].capitalize()}: {message['content']}"
+        current.append(line)
+        used += estimate_tokens(line)
+    recent = []
+    for message in reversed(messages[recent_start:]):
+        line = f"\n{message['role'].capitalize()}: {message['content']}"
+        cost = estimate_tokens(line)
+        if recent and used + cost > token_budget:
+            break
+        recent.insert(0, line)
+        used += cost
+
+    excerpts = []
+    if index is not None:
+        in_prompt = {(chat_id, position) for position in range(len(messages) - len(recent), len(messages))}
+        in_prompt.update((chat_id, position) for position in range(len(system)))
+        for doc in index.search(user_message, top_k, exclude=in_prompt):
+            line = f"\n- {doc['role'].capitalize()}: {doc['text']}"
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                continue
+            excerpts.append(line)
+            used += cost
+
+    context = ""
+    if excerpts:
+        context += "\nRelevant excerpts from the user's earlier conversations:" + "".join(excerpts) + "\n"
+    context += "\nCurrent conversation:" + "".join(current + recent) + tail
+    return context
+
+
+chat_indexes = ChatIndexRegistry(
+    max_users=int(os.getenv("CHAT_INDEX_MAX_USERS", "256")),
+    max_bytes=int(os.getenv("CHAT_INDEX_MAX_MB", "256")) * 1024 * 1024,
+    max_user_bytes=int(os.getenv("CHAT_INDEX_MAX_USER_MB", "32")) * 1024 * 1024
+)
+
+
+if __name__ == "__main__":
+    # Build/query benchmark at 10k+ messages for one user
+    import random
+
+    random.seed(11)
+    vocabulary = [("".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(3, 9))))
+                  for _ in range(20000)]
+
+    def sentence(words):
+        return " ".join(random.choice(vocabulary) for _ in range(words))
+
+    chats_count, turns = 900, 12
+    corpus = [(f"chat-{c}", [{"role": "ai" if t % 2 else "user", "content": sentence(400 if t % 2 else 15)}
+                             for t in range(turns)]) for c in range(chats_count)]
+
+    started = time.perf_counter()
+    index = BM25Index()
+    for chat_id, messages in corpus:
+        index.add_chat(chat_id, messages)
+    build_s = time.perf_counter() - started
+    print(f"indexed {chats_count * turns} messages ({len(index)} chunks) in {build_s:.2f}s, "
+          f"~{index.bytes / 2 ** 20:.0f} MB estimated")
+
+    queries = [sentence(12) for _ in range(200)]
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, 8)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"query p50 {timings[len(timings) // 2] * 1000:.2f} ms, p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms")
+
+    chat_id, messages = corpus[0]
+    full = "".join(f"\n{m['role'].capitalize()}: {m['content']}" for m in messages)
+    bounded = build_chat_context(index, chat_id, messages, queries[0], token_budget=1500)
+    print(f"prompt tokens, full transcript: {estimate_tokens(full)}, bounded: {estimate_tokens(bounded)}")
@@ -0,0 +1,152 @@
+import gzip
+import os
+import threading
+import time
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+class ResponseCompressor:
+    """Negotiated gzip/brotli compression of Flask responses.
+
+    Bodies of at least min_size bytes are compressed with the best encoding
+    the client accepts (brotli when the brotli package is installed, else
+    gzip). Small bodies, streamed responses, 304s and responses that are
+    already encoded are sent as they are. A strong ETag is made weak, since
+    the compressed bytes differ from the identity representation.
+    """
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def install(self, app):
+        app.after_request(self._after_request)
+        return self
+
+    def choose_encoding(self, accept_encodings):
+        offered = (["br"] if brotli is not None else []) + ["gzip"]
+        best, best_quality = None, 0
+        for encoding in offered:
+            quality = accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, encoding, body):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    def _after_request(self, response):
+        if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+                or response.status_code in (204, 304) or "Content-Encoding" in response.headers):
+            return response
+        response.vary.add("Accept-Encoding")
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        encoding = self.choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        started = time.thread_time()
+        compressed = self.compress(encoding, body)
+        cpu = time.thread_time() - started
+        self._record(encoding, len(body), len(compressed), cpu)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _record(self, encoding, raw_bytes, sent_bytes, cpu):
+        with self._lock:
+            entry = self._stats.setdefault(encoding, {"responses": 0, "raw_bytes": 0, "sent_bytes": 0, "cpu_s": 0.0})
+            entry["responses"] += 1
+            entry["raw_bytes"] += raw_bytes
+            entry["sent_bytes"] += sent_bytes
+            entry["cpu_s"] += cpu
+
+    def stats(self):
+        with self._lock:
+            return {
+                encoding: {
+                    "responses": entry["responses"],
+                    "raw_bytes": entry["raw_bytes"],
+                    "sent_bytes": entry["sent_bytes"],
+                    "ratio": round(entry["sent_bytes"] / entry["raw_bytes"], 3),
+                    "avg_cpu_ms": round(entry["cpu_s"] * 1000 / entry["responses"], 3)
+                }
+                for encoding, entry in self._stats.items()
+            }
+
+
+def compression_from_env():
+    return ResponseCompressor(
+        min_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")),
+        gzip_level=int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+        brotli_quality=int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+    )
+
+
+if __name__ == "__main__":
+    # Bytes on the wire and CPU per request for a /learn-sized explanation and
+    # a full /get-conversation-history payload, plus 304s for unchanged polls
+    import random
+    from flask import Flask, jsonify
+    from etags import VersionCounter, conditional_get
+
+    random.seed(5)
+    words = ["memory", "attention", "planning", "visual", "learning", "the", "a", "concept", "step",
+             "example", "because", "process", "recursion", "function", "call", "stack", "base", "case"]
+
+    def text(n):
+        return " ".join(random.choice(words) for _ in range(n))
+
+    explanation = {"chat_id": "x" * 20, "profile_type": "Strategic Planner", "output": text(900)}
+    history = {"user_id": "u1", "conversation_history": [{"question": text(30), "response": text(120)}
+                                                         for _ in range(6)]}
+    versions = VersionCounter()
+    versions.bump("u1")
+
+    stub = Flask(__name__)
+
+    @stub.route("/learn")
+    def learn():
+        return jsonify(explanation)
+
+    @stub.route("/get-conversation-history")
+    @conditional_get(lambda: versions.etag(request.args.get("user_id")))
+    def conversation_history():
+        return jsonify(history)
+
+    compressor = ResponseCompressor().install(stub)
+    client = stub.test_client()
+    runs = 300
+
+    def measure(path, headers):
+        started = time.process_time()
+        for _ in range(runs):
+            response = client.get(path, headers=headers)
+        return response, (time.process_time() - started) * 1000 / runs
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    for path in ["/learn", "/get-conversation-history?user_id=u1"]:
+        for encoding in encodings:
+            response, cpu_ms = measure(path, {"Accept-Encoding": encoding})
+            print(f"{path:40} {encoding:8} {len(response.get_data()):6} B  {cpu_ms:.3f} ms CPU/request")
+    etag = response.headers["ETag"]
+    response, cpu_ms = measure(path, {"Accept-Encoding": encodings[-1], "If-None-Match": etag})
+    print(f"{path:40} {response.status_code:<8} {len(response.get_data()):6} B  {cpu_ms:.3f} ms CPU/request")
+    print(compressor.stats())
@@ -1,18 +1,34 @@
 import os
 import json
 import uuid
-from datetime import datetime
+import hashlib
+import hmac
 from glob import glob
 
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
 
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify, session, stream_with_context
+from google.api_core.exceptions import FailedPrecondition
 from dotenv import load_dotenv
 
 from crewai import Agent, Task, Crew
 from langchain_groq import ChatGroq
 
+from prompt_templates import register_template
+from llm_calls import kickoff_crew
+from usage_accounting import QuotaExceeded, usage_accountant
+from chat_cache import chat_cache
+from firestore_repo import runner, users, chats
+from llm_cassette import install_http_recorder, note_parse
+from admission import admission_from_env
+from idempotency import idempotent
+from content_store import content_store
+from chat_index import chat_indexes, build_chat_context
+from curriculum import parse_concepts, stream_batch
+from compression import compression_from_env
+from stats_routes import install_stats_routes
+
 
 
 global_concept=''
@@ -33,8 +49,6 @@ def initialize_firebase():
     if not firebase_admin._apps:
         cred = credentials.Certificate(cred_path)
         firebase_admin.initialize_app(cred)
-    
-    return firebase_admin.firestore.client()
 
 # --- Load Environment Variables ---
 load_dotenv()
@@ -42,6 +56,15 @@ load_dotenv()
 # --- Flask App Setup ---
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "default_secret_key")
+usage_accountant.start_flusher(int(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "30")))
+install_http_recorder(app)
+# LLM-backed routes get bounded concurrency and fast 503s when saturated;
+# the stats and admin routes are left unlimited.
+admission = admission_from_env(["/learn", "/learn-batch", "/chat"]).install(app)
+# Long explanations are gzip/brotli compressed for clients that accept it
+compressor = compression_from_env().install(app)
+
+GROQ_MODEL = "groq/gemma2-9b-it"
 
 # --- Cognitive Profiles ---
 COGNITIVE_PROFILES = {
@@ -97,6 +120,55 @@ COGNITIVE_PROFILES = {
     }
 }
 
+# --- Format Guidance ---
+FORMAT_GUIDANCE = {
+    "text": "Use clear, structured text with examples.",
+    "visual": "Use diagrams, flowcharts, or visual metaphors (ASCII if needed).",
+    "code example": "Include code snippets with explanation.",
+    "step-by-step": "Break explanation into clear, numbered steps.",
+    "real-world": "Include real-world use cases or examples."
+}
+DEFAULT_FORMAT_INSTRUCTION = "Use clear and structured explanation."
+
+# --- Prompt Templates ---
+# Compiled once at import; the static instruction comes first so it is
+# byte-identical across requests and only the per-request part is rendered.
+LEARN_TEMPLATE = register_template(
+    "learn",
+    static=("Ensure the explanation aligns with the user's cognitive learning preferences. "
+            "Explain concepts in a way that aligns with the profile's learning preferences and cognitive strengths."),
+    dynamic=("The user has a cognitive profile of '{profile_type}'.\n"
+             "Rationale: {rationale}\n"
+             "Explain the concept '{concept}' at a {difficulty} level for a user with the '{profile_type}' profile. "
+             "The user prefers {format_pref} format. {format_instruction}")
+)
+# The agent backstory is sent ahead of the task, so it stays identical for
+# every user; everything per-user goes in the template's dynamic body.
+LEARN_BACKSTORY = ("You are a cognitive learning expert who explains concepts in a way that aligns with "
+                   "each learner's cognitive profile, learning preferences and cognitive strengths.")
+LEARN_ROLE = "Cognitive Learning Expert"
+LEARN_GOAL = "Generate a personalized learning explanation based on cognitive traits"
+LEARN_EXPECTED_OUTPUT = ("A personalized explanation suitable to the user's cognitive style, "
+                         "preferred format, and difficulty level.")
+
+# Pre-generated explanations are tagged with this; any change to the learn
+# prompt or model makes them stale until the pre-generation job reruns.
+LEARN_PROMPT_VERSION = hashlib.sha256("\n".join([
+    GROQ_MODEL, LEARN_TEMPLATE.static, LEARN_TEMPLATE.dynamic, LEARN_BACKSTORY, LEARN_ROLE, LEARN_GOAL,
+    LEARN_EXPECTED_OUTPUT, DEFAULT_FORMAT_INSTRUCTION, json.dumps(FORMAT_GUIDANCE, sort_keys=True)
+]).encode()).hexdigest()[:16]
+DIFFICULTY_LEVELS = ["beginner", "intermediate", "advanced"]
+
+CHAT_BACKSTORY = ("You help a learner with follow-up questions about concepts they are studying, "
+                  "using their earlier conversations and cognitive profile as context.")
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "1500"))
+# Transcript writes retried when another worker changed the chat meanwhile
+CHAT_WRITE_ATTEMPTS = 3
+
+# /learn-batch limits: concurrent LLM calls per batch, and concepts per batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCEPTS = int(os.getenv("BATCH_MAX_CONCEPTS", "20"))
+
 # --- Utility Functions ---
 def get_latest_classification_file(directory="classifications"):
     """Find the most recently modified classification file"""
@@ -117,12 +189,49 @@ def load_profile_type(filepath):
         print(f"Error loading classification: {e}")
         return None
 
+def generate_explanation(groq_api_key, concept, difficulty, format_pref, profile_type, rationale,
+                         user_id=None, route="/learn"):
+    """Run the learning agent for one concept and return the explanation text"""
+    llm = ChatGroq(api_key=groq_api_key, model=GROQ_MODEL)
+
+    # Agent
+    learning_agent = Agent(
+        role=LEARN_ROLE,
+        goal=LEARN_GOAL,
+        backstory=LEARN_BACKSTORY,
+        verbose=True,
+        allow_delegation=False,
+        llm=llm
+    )
+
+    # Task
+    format_instruction = FORMAT_GUIDANCE.get(format_pref.lower(), DEFAULT_FORMAT_INSTRUCTION)
+    task = Task(
+        description=LEARN_TEMPLATE.render(
+            concept=concept,
+            difficulty=difficulty,
+            profile_type=profile_type,
+            rationale=rationale,
+            format_pref=format_pref,
+            format_instruction=format_instruction
+        ),
+        expected_output=LEARN_EXPECTED_OUTPUT,
+        agent=learning_agent
+    )
+
+    # Run Crew
+    crew = Crew(agents=[learning_agent], tasks=[task], verbose=True)
+    result = str(kickoff_crew(crew, route, user_id, GROQ_MODEL, task.description))
+    note_parse(route, result.strip())
+    return result
+
 # --- Learn Route ---
 @app.route('/learn', methods=['POST'])
+@idempotent
 def learn_concept():
     try:
         # Initialize Firebase
-        db = initialize_firebase()
+        initialize_firebase()
 
         # Parse input data
         data = request.json
@@ -134,77 +243,47 @@ def learn_concept():
         if not concept or not user_id:
             return jsonify({"error": "Concept or user_id not provided"}), 400
 
-        # Create chat session ID using Firestore auto-generated ID
-        chat_ref = db.collection('users').document(user_id).collection('chats').document()
-        chat_id = chat_ref.id  # Firestore-generated ID
-        session['user_id'] = user_id
+        # Create chat session ID in Firestore's auto-ID format
+        chat_id = chats.new_chat_id()
+        # The cookie only carries the opaque chat ID; /chat reads the transcript server-side
         session['chat_id'] = chat_id
 
-        # Fetch cognitive profile from Firestore
-        user_doc = db.collection("users").document(user_id).get()
-        if not user_doc.exists:
+        cognitive_profile = runner.run(users.get_cognitive_profile(user_id))
+        if cognitive_profile is None:
             return jsonify({"error": f"No user profile found for user_id: {user_id}"}), 404
 
-        profile_data = user_doc.to_dict().get("cognitive_profile", {}).get("classification", {})
+        profile_data = cognitive_profile.get("classification", {})
         profile_type = profile_data.get("profile", "General Learner")
         rationale = profile_data.get("rationale", "No rationale provided.")
         global_concept = concept
 
-        # LLM Setup
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            return jsonify({"error": "Groq API key not found"}), 500
-
-        llm = ChatGroq(api_key=groq_api_key, model="groq/gemma2-9b-it")
-
-        # Agent
-        learning_agent = Agent(
-            role="Cognitive Learning Expert",
-            goal="Generate a personalized learning explanation based on cognitive traits",
-            backstory=(f"The user has a cognitive profile of '{profile_type}'.\n"
-                       f"Rationale: {rationale}\n"
-                       "You must explain concepts in a way that aligns with this profile's learning preferences and cognitive strengths."),
-            verbose=True,
-            allow_delegation=False,
-            llm=llm
-        )
-
-        # Format Guidance
-        format_guidance = {
-            "text": "Use clear, structured text with examples.",
-            "visual": "Use diagrams, flowcharts, or visual metaphors (ASCII if needed).",
-            "code example": "Include code snippets with explanation.",
-            "step-by-step": "Break explanation into clear, numbered steps.",
-            "real-world": "Include real-world use cases or examples."
-        }
-        format_instruction = format_guidance.get(format_pref.lower(), "Use clear and structured explanation.")
-
-        # Task
-        task = Task(
-            description=(f"Explain the concept '{concept}' at a {difficulty} level for a user with the '{profile_type}' profile. "
-                          f"The user prefers {format_pref} format. {format_instruction} "
-                          f"Ensure the explanation aligns with the user's cognitive learning preferences."),
-            expected_output="A personalized explanation suitable to the user's cognitive style, preferred format, and difficulty level.",
-            agent=learning_agent
-        )
-
-        # Run Crew
-        crew = Crew(agents=[learning_agent], tasks=[task], verbose=True)
-        result = str(crew.kickoff())
-
-        # Store in session
-        session['context'] = result
-
-        # Save to Firestore under chat history
-        chat_ref.set({
-            "messages": [
-                {"role": "system", "content": f"Profile: {profile_type}"},
-                {"role": "user", "content": f"Learn about: {concept}"},
-                {"role": "ai", "content": result}
-            ],
-            "updated_at": datetime.utcnow(),
-            "title": concept,
-        })
+        # Serve a pre-generated explanation for this cell when there is a fresh one
+        result = content_store.get(concept, profile_type, format_pref, difficulty, LEARN_PROMPT_VERSION)
+        if result is None:
+            # Only an LLM call counts against the quota; stored explanations are free
+            quota_error = usage_accountant.check_quota(user_id)
+            if quota_error:
+                return jsonify({"error": quota_error}), 429
+
+            # LLM Setup
+            groq_api_key = os.getenv("GROQ_API_KEY")
+            if not groq_api_key:
+                return jsonify({"error": "Groq API key not found"}), 500
+
+            result = generate_explanation(groq_api_key, concept, difficulty, format_pref,
+                                          profile_type, rationale, user_id)
+
+        # Save to Firestore under chat history; nothing is written until there
+        # is an explanation, so a failed generation leaves no empty chat behind
+        messages = [
+            {"role": "system", "content": f"Profile: {profile_type}"},
+            {"role": "user", "content": f"Learn about: {concept}"},
+            {"role": "ai", "content": result}
+        ]
+        update_time = runner.run(chats.create(user_id, chat_id, concept, messages))
+        # Follow-up /chat turns are served from the hot cache
+        chat_cache.put(user_id, chat_id, messages, update_time)
+        chat_indexes.add_chat(user_id, chat_id, messages)
 
         return jsonify({
             "chat_id": chat_id,  # Returning Firestore-generated chat ID
@@ -222,12 +301,88 @@ def learn_concept():
 
 
 
+# --- Batch Learn Route ---
+@app.route('/learn-batch', methods=['POST'])
+def learn_batch():
+    """Generate explanations for a whole curriculum in one request.
+
+    The profile is read once, explanations are generated concurrently (at
+    most BATCH_CONCURRENCY at a time) and streamed back as NDJSON lines as
+    each finishes; all chat documents are then written in one batch and a
+    final line carries their chat IDs.
+    """
+    try:
+        # Initialize Firebase
+        initialize_firebase()
+
+        # Parse input data
+        data = request.json
+        user_id = data.get('user_id')
+        difficulty = data.get('difficulty', 'intermediate')
+        format_pref = data.get('format', 'text')
+
+        if not user_id:
+            return jsonify({"error": "user_id not provided"}), 400
+        concepts, error = parse_concepts(data.get('concepts'), BATCH_MAX_CONCEPTS)
+        if error:
+            return jsonify({"error": error}), 400
+
+        cognitive_profile = runner.run(users.get_cognitive_profile(user_id))
+        if cognitive_profile is None:
+            return jsonify({"error": f"No user profile found for user_id: {user_id}"}), 404
+
+        profile_data = cognitive_profile.get("classification", {})
+        profile_type = profile_data.get("profile", "General Learner")
+        rationale = profile_data.get("rationale", "No rationale provided.")
+
+        groq_api_key = os.getenv("GROQ_API_KEY")
+        if not groq_api_key:
+            return jsonify({"error": "Groq API key not found"}), 500
+
+        def explain(concept):
+            result = content_store.get(concept, profile_type, format_pref, difficulty, LEARN_PROMPT_VERSION)
+            if result is None:
+                # Each LLM call in the batch counts against the quota
+                quota_error = usage_accountant.check_quota(user_id)
+                if quota_error:
+                    raise QuotaExceeded(quota_error)
+                result = generate_explanation(groq_api_key, concept, difficulty, format_pref,
+                                              profile_type, rationale, user_id, route="/learn-batch")
+            return result
+
+        def save(completed):
+            # Every chat document in one batched write
+            new_chats = [
+                (chats.new_chat_id(), concept, [
+                    {"role": "system", "content": f"Profile: {profile_type}"},
+                    {"role": "user", "content": f"Learn about: {concept}"},
+                    {"role": "ai", "content": result}
+                ])
+                for concept, result in completed
+            ]
+            update_times = runner.run(chats.create_many(user_id, new_chats))
+            for (chat_id, _, messages), update_time in zip(new_chats, update_times):
+                chat_cache.put(user_id, chat_id, messages, update_time)
+                chat_indexes.add_chat(user_id, chat_id, messages)
+            return [chat_id for chat_id, _, _ in new_chats]
+
+        lines = stream_batch(concepts, explain, save, BATCH_CONCURRENCY,
+                             extra={"difficulty": difficulty, "format": format_pref, "profile_type": profile_type})
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+    except Exception as e:
+        print(f"Error in learn_batch: {str(e)}")
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+
 # --- Chat Route ---
 @app.route('/chat', methods=['POST'])
+@idempotent
 def chat():
     try:
         # Initialize Firebase
-        db = initialize_firebase()
+        initialize_firebase()
 
         # Parse input data
         data = request.json
@@ -238,28 +393,35 @@ def chat():
         if not user_message or not user_id or not chat_id:
             return jsonify({"error": "Missing message, user_id, or chat_id"}), 400
 
-        # Retrieve chat history
-        chat_ref = db.collection("users").document(user_id).collection("chats").document(chat_id)
-        chat_doc = chat_ref.get()
-        if not chat_doc.exists:
-            return jsonify({"error": "Chat history not found"}), 404
+        quota_error = usage_accountant.check_quota(user_id)
+        if quota_error:
+            return jsonify({"error": quota_error}), 429
 
-        conversation_context = ""
-        for msg in chat_doc.to_dict().get("messages", []):
-            role = msg["role"].capitalize()
-            conversation_context += f"\n{role}: {msg['content']}"
-        conversation_context += f"\nUser: {user_message}\nAI:"
+        # Retrieve chat history
+        cached = chat_cache.get(user_id, chat_id)
+        if cached is None:
+            cached = runner.run(chats.get(user_id, chat_id))
+            if cached is None:
+                return jsonify({"error": "Chat history not found"}), 404
+            chat_cache.put(user_id, chat_id, *cached)
+        messages, last_update_time = cached
+
+        # Ground the answer in the recent turns plus the most relevant snippets
+        # from all of the user's chats, under a token budget. The user's index
+        # is built in the background; until it is ready, only recent turns are used.
+        index = chat_indexes.get(user_id, lambda: runner.run(chats.list_chats(user_id), timeout=120))
+        conversation_context = build_chat_context(index, chat_id, messages, user_message, CHAT_CONTEXT_TOKEN_BUDGET)
 
         # LLM Setup
         groq_api_key = os.getenv("GROQ_API_KEY")
         if not groq_api_key:
             return jsonify({"error": "Groq API key not found"}), 500
 
-        llm = ChatGroq(api_key=groq_api_key, model="groq/gemma2-9b-it")
+        llm = ChatGroq(api_key=groq_api_key, model=GROQ_MODEL)
         chat_agent = Agent(
             role="Cognitive Learning Expert",
             goal="Answer follow-up questions based on previous context",
-            backstory=conversation_context,
+            backstory=CHAT_BACKSTORY,
             verbose=True,
             allow_delegation=False,
             llm=llm
@@ -272,17 +434,33 @@ def chat():
         )
 
         crew = Crew(agents=[chat_agent], tasks=[task], verbose=True)
-        result = str(crew.kickoff())
-
-        # Update Firestore
-        chat_ref.update({
-            "messages": firestore.ArrayUnion([
-                {"role": "user", "content": user_message},
-                {"role": "ai", "content": result}
-            ]),
-            "updated_at": datetime.utcnow(),
-            
-        })
+        result = str(kickoff_crew(crew, "/chat", user_id, GROQ_MODEL, conversation_context))
+        note_parse("/chat", result.strip())
+
+        # Write the whole transcript back, write-through to the hot cache. The
+        # precondition fails if another worker changed the chat since we read
+        # it; re-read and retry so its turns are kept. Writing the full list
+        # (not an ArrayUnion, which drops repeated messages) keeps Firestore,
+        # the cache and the chat index in step.
+        new_messages = [
+            {"role": "user", "content": user_message},
+            {"role": "ai", "content": result}
+        ]
+        for attempt in range(CHAT_WRITE_ATTEMPTS):
+            try:
+                update_time = runner.run(
+                    chats.replace_messages(user_id, chat_id, messages + new_messages, last_update_time))
+                break
+            except FailedPrecondition:
+                chat_cache.invalidate(user_id, chat_id)
+                if attempt == CHAT_WRITE_ATTEMPTS - 1:
+                    raise
+                cached = runner.run(chats.get(user_id, chat_id))
+                if cached is None:
+                    return jsonify({"error": "Chat history not found"}), 404
+                messages, last_update_time = cached
+        chat_cache.put(user_id, chat_id, messages + new_messages, update_time)
+        chat_indexes.add_chat(user_id, chat_id, new_messages)
 
         return jsonify({"response": result})
 
@@ -290,6 +468,32 @@ def chat():
         print(f"Error in chat: {str(e)}")
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
+# --- Stats Routes ---
+def content_store_stats():
+    stats = content_store.stats(LEARN_PROMPT_VERSION)
+    stats["prompt_version"] = LEARN_PROMPT_VERSION
+    return stats
+
+install_stats_routes(app, admission, compressor, {
+    "/chat-cache-stats": chat_cache.stats,
+    "/chat-index-stats": chat_indexes.stats,
+    "/content-store-stats": content_store_stats,
+})
+
+# --- Admin Usage Route ---
+@app.route('/admin/usage', methods=['GET'])
+def admin_usage():
+    """Top LLM consumers for a day, by tokens"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), admin_token.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        limit = int(request.args.get("limit", 10))
+        return jsonify({"top_consumers": usage_accountant.top_consumers(limit, request.args.get("day"))})
+    except Exception as e:
+        print(f"Error in admin_usage: {str(e)}")
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
 # --- Run ---
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
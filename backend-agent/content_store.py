@@ -0,0 +1,76 @@
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+
+
+def normalize(value):
+    """Case- and whitespace-insensitive key part; 'The Strategic Planner' == 'strategic planner'"""
+    value = re.sub(r"\s+", " ", (value or "").strip().lower())
+    return value[4:] if value.startswith("the ") else value
+
+
+class ContentStore:
+    """Compact local store of pre-generated explanations.
+
+    One row per concept x profile x format x difficulty cell, compressed with
+    zlib. Every row carries the prompt version it was generated with; lookups
+    ignore rows from other versions, so changing the prompt makes old entries
+    stale until the pre-generation job refreshes them.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS explanations (
+                    concept TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    difficulty TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (concept, profile, format, difficulty)
+                )"""
+            )
+
+    def _connect(self):
+        # One connection per thread; Flask serves requests from several threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=5)
+        return conn
+
+    def _key(self, concept, profile, format_pref, difficulty):
+        return normalize(concept), normalize(profile), normalize(format_pref), normalize(difficulty)
+
+    def get(self, concept, profile, format_pref, difficulty, prompt_version):
+        row = self._connect().execute(
+            "SELECT body FROM explanations WHERE concept = ? AND profile = ? AND format = ? AND difficulty = ? "
+            "AND prompt_version = ?",
+            self._key(concept, profile, format_pref, difficulty) + (prompt_version,)
+        ).fetchone()
+        return zlib.decompress(row[0]).decode() if row else None
+
+    def put(self, concept, profile, format_pref, difficulty, prompt_version, text):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO explanations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._key(concept, profile, format_pref, difficulty) + (
+                    prompt_version, zlib.compress(text.encode(), 9), datetime.now(timezone.utc).isoformat()
+                )
+            )
+
+    def stats(self, prompt_version=None):
+        conn = self._connect()
+        total, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM explanations").fetchone()
+        fresh = conn.execute("SELECT COUNT(*) FROM explanations WHERE prompt_version = ?",
+                             (prompt_version,)).fetchone()[0] if prompt_version else None
+        return {"entries": total, "fresh_entries": fresh, "compressed_bytes": size}
+
+
+content_store = ContentStore(os.getenv("CONTENT_STORE_PATH", "pregenerated_content.db"))
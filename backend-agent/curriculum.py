@@ -0,0 +1,121 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def parse_concepts(value, max_concepts):
+    """Return (concepts, error) for a /learn-batch 'concepts' field"""
+    if not isinstance(value, list) or not value:
+        return None, "concepts must be a non-empty list of strings"
+    if not all(isinstance(concept, str) and concept.strip() for concept in value):
+        return None, "every concept must be a non-empty string"
+    if len(value) > max_concepts:
+        return None, f"At most {max_concepts} concepts per batch"
+    return [concept.strip() for concept in value], None
+
+
+def stream_batch(concepts, explain, save, concurrency, extra=None):
+    """Generate explanations concurrently and yield NDJSON lines as they finish.
+
+    explain(concept) returns the explanation text; save([(concept, text)])
+    persists all of them in one write and returns their chat IDs in order.
+    Chat IDs are only sent in the final line, after save() succeeded, so the
+    client never holds IDs of chats that were not written. If the client goes
+    away mid-stream, the remaining explanations are still awaited and saved,
+    since their LLM cost is already spent.
+    """
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    futures = {pool.submit(explain, concept): concept for concept in concepts}
+    completed = []
+    persisted = False
+    try:
+        for future in as_completed(futures):
+            concept = futures[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                yield json.dumps({"concept": concept, "error": str(e)}) + "\n"
+                continue
+            completed.append((concept, text))
+            yield json.dumps(dict(extra or {}, concept=concept, output=text)) + "\n"
+
+        persisted = True
+        try:
+            chat_ids = save(completed) if completed else []
+        except Exception as e:
+            print(f"Error saving learn_batch chats: {str(e)}")
+            yield json.dumps({"done": True, "saved": 0, "error": str(e)}) + "\n"
+            return
+        yield json.dumps({
+            "done": True,
+            "saved": len(chat_ids),
+            "chats": [{"concept": concept, "chat_id": chat_id}
+                      for (concept, _), chat_id in zip(completed, chat_ids)]
+        }) + "\n"
+    finally:
+        pool.shutdown(wait=not persisted)
+        if not persisted:
+            # Client disconnected; keep whatever the LLM produced
+            finished = [(futures[f], f.result()) for f in futures if f.exception() is None]
+            try:
+                if finished:
+                    save(finished)
+            except Exception as e:
+                print(f"Error saving learn_batch chats after disconnect: {str(e)}")
+
+
+if __name__ == "__main__":
+    # 10-concept curriculum: one /learn-batch request vs 10 sequential /learn
+    # calls, against a stub LLM (~1s per explanation) and stub Firestore
+    # (~40 ms per round trip), through the Flask test client.
+    import random
+    import time
+    from flask import Flask, Response, jsonify, request
+
+    random.seed(2)
+    LLM_SECONDS, ROUND_TRIP_SECONDS, CONCURRENCY = 1.0, 0.04, 4
+
+    def stub_llm(concept):
+        time.sleep(LLM_SECONDS * random.uniform(0.8, 1.2))
+        return f"Explanation of {concept}"
+
+    def stub_round_trip():
+        time.sleep(ROUND_TRIP_SECONDS)
+
+    stub = Flask(__name__)
+
+    @stub.route("/learn", methods=["POST"])
+    def learn():
+        stub_round_trip()  # profile read
+        text = stub_llm(request.json["concept"])
+        stub_round_trip()  # chat write
+        return jsonify({"chat_id": "x", "output": text})
+
+    @stub.route("/learn-batch", methods=["POST"])
+    def learn_batch():
+        concepts, error = parse_concepts(request.json.get("concepts"), 20)
+        if error:
+            return jsonify({"error": error}), 400
+        stub_round_trip()  # profile read
+
+        def save(completed):
+            stub_round_trip()  # one batched write
+            return [f"chat-{i}" for i in range(len(completed))]
+
+        return Response(stream_batch(concepts, stub_llm, save, CONCURRENCY), mimetype="application/x-ndjson")
+
+    client = stub.test_client()
+    curriculum = [f"concept {i}" for i in range(10)]
+
+    started = time.perf_counter()
+    for concept in curriculum:
+        client.post("/learn", json={"concept": concept})
+    sequential_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    response = client.post("/learn-batch", json={"concepts": curriculum})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    batch_s = time.perf_counter() - started
+
+    print(f"10 x /learn: {sequential_s:.2f}s, /learn-batch (concurrency {CONCURRENCY}): {batch_s:.2f}s, "
+          f"{sequential_s / batch_s:.1f}x faster; saved {lines[-1]['saved']} chats")
+    print("concepts='Recursion' ->", client.post("/learn-batch", json={"concepts": "Recursion"}).get_json())
@@ -0,0 +1,78 @@
+import functools
+import itertools
+import threading
+import uuid
+from datetime import datetime
+
+from flask import current_app, make_response, request
+
+
+class VersionCounter:
+    """Per-session version numbers for cheap ETags.
+
+    Every change to a session bumps its version to the next value of one
+    process-wide counter, so a version is never reused, even after a session
+    is cleared and recreated. The ETag combines the version with a per-process
+    boot ID, so tags issued before a restart never match.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.global_version = 0
+        self.last_change = datetime.now()
+
+    def bump(self, key):
+        with self._lock:
+            self.global_version = self._versions[key] = next(self._counter)
+            self.last_change = datetime.now()
+
+    def forget(self, key):
+        """Drop a deleted session; a recreated one gets a fresh, higher version"""
+        with self._lock:
+            self._versions.pop(key, None)
+            self.global_version = next(self._counter)
+            self.last_change = datetime.now()
+
+    def etag(self, key):
+        """ETag for one session; None for a missing key or an unknown session"""
+        if key is None:
+            return None
+        with self._lock:
+            version = self._versions.get(key)
+        return None if version is None else f"{self.boot_id}-{version}"
+
+    def global_etag(self):
+        """ETag that changes whenever any session changes"""
+        with self._lock:
+            return f"{self.boot_id}-g{self.global_version}"
+
+
+def conditional_get(etag_for):
+    """Answer If-None-Match with 304 when etag_for() still matches.
+
+    etag_for() is called before the view, to skip it for an unchanged
+    resource, and again after it, since the view itself may change the
+    version. A None tag disables the check.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = etag_for()
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            etag = etag_for()
+            if etag is not None and response.status_code == 200:
+                response.set_etag(etag)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,196 @@
+import asyncio
+import secrets
+import string
+import threading
+from datetime import datetime
+
+
+class AsyncRunner:
+    """Runs coroutines on one background event loop shared by all request threads.
+
+    Flask handlers stay synchronous; they hand coroutines to run(), which
+    blocks only the calling thread until the result is ready. The loop holds
+    the one async client, so its channel is reused by every request instead
+    of each worker thread opening its own.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="firestore-async", daemon=True).start()
+            return self._loop
+
+    def run(self, coro, timeout=30):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+runner = AsyncRunner()
+
+
+def _default_client():
+    from firebase_admin import firestore_async
+    return firestore_async.client()
+
+
+class FirestoreRepository:
+    """Lazily creates the async client on the runner's loop, where it is used"""
+
+    def __init__(self, client_factory=_default_client):
+        self._client_factory = client_factory
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+
+class UserRepository(FirestoreRepository):
+    """users/{uid} documents and the cognitive profile stored on them"""
+
+    def _ref(self, user_id):
+        return self.client.collection("users").document(user_id)
+
+    async def get_cognitive_profile(self, user_id):
+        """Return the stored cognitive_profile dict, or None if the user doesn't exist"""
+        snapshot = await self._ref(user_id).get()
+        if not snapshot.exists:
+            return None
+        return snapshot.to_dict().get("cognitive_profile", {})
+
+    async def save_cognitive_profile(self, user_id, cognitive_profile):
+        await self._ref(user_id).set({"cognitive_profile": cognitive_profile}, merge=True)
+
+
+class ChatRepository(FirestoreRepository):
+    """users/{uid}/chats/{chat_id} transcripts"""
+
+    def _chats(self, user_id):
+        return self.client.collection("users").document(user_id).collection("chats")
+
+    def new_chat_id(self):
+        """Random 20-character ID in the same format Firestore auto-generates"""
+        alphabet = string.ascii_letters + string.digits
+        return "".join(secrets.choice(alphabet) for _ in range(20))
+
+    async def create(self, user_id, chat_id, title, messages=()):
+        """Create the chat document and return its update_time"""
+        result = await self._chats(user_id).document(chat_id).set({
+            "messages": list(messages),
+            "updated_at": datetime.utcnow(),
+            "title": title,
+        })
+        return result.update_time
+
+    async def create_many(self, user_id, new_chats):
+        """Create several chats in one batched write.
+
+        new_chats is a list of (chat_id, title, messages); returns the
+        update_time of each document, in the same order.
+        """
+        batch = self.client.batch()
+        now = datetime.utcnow()
+        for chat_id, title, messages in new_chats:
+            batch.set(self._chats(user_id).document(chat_id), {
+                "messages": list(messages),
+                "updated_at": now,
+                "title": title,
+            })
+        results = await batch.commit()
+        return [result.update_time for result in results]
+
+    async def get(self, user_id, chat_id):
+        """Return (messages, update_time), or None if the chat doesn't exist"""
+        snapshot = await self._chats(user_id).document(chat_id).get()
+        if not snapshot.exists:
+            return None
+        return snapshot.to_dict().get("messages", []), snapshot.update_time
+
+    async def replace_messages(self, user_id, chat_id, messages, last_update_time=None):
+        """Overwrite the transcript and return the new update_time.
+
+        With last_update_time the write only applies if the document has not
+        changed since; otherwise google.api_core FailedPrecondition is raised.
+        """
+        options = {}
+        if last_update_time is not None:
+            options["option"] = self.client.write_option(last_update_time=last_update_time)
+        result = await self._chats(user_id).document(chat_id).update({
+            "messages": list(messages),
+            "updated_at": datetime.utcnow(),
+        }, **options)
+        return result.update_time
+
+    async def list_chats(self, user_id):
+        """All of a user's chats as (chat_id, messages) pairs"""
+        chats = []
+        async for snapshot in self._chats(user_id).stream():
+            chats.append((snapshot.id, (snapshot.to_dict() or {}).get("messages", [])))
+        return chats
+
+    async def list_titles(self):
+        """Titles of every chat across all users (a collection-group scan)"""
+        titles = []
+        async for snapshot in self.client.collection_group("chats").select(["title"]).stream():
+            title = (snapshot.to_dict() or {}).get("title")
+            if title:
+                titles.append(title)
+        return titles
+
+
+users = UserRepository()
+chats = ChatRepository()
+
+
+if __name__ == "__main__":
+    # Benchmark against the Firestore emulator:
+    #   FIRESTORE_EMULATOR_HOST=localhost:8080 python firestore_repo.py
+    import os
+    import time
+    from google.cloud.firestore import AsyncClient
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("Set FIRESTORE_EMULATOR_HOST to run the benchmark against the emulator")
+
+    def emulator_client():
+        return AsyncClient(project="demo-cogbot")
+
+    bench_users = UserRepository(emulator_client)
+    bench_chats = ChatRepository(emulator_client)
+    user_id = "bench-user"
+    runner.run(bench_users.save_cognitive_profile(user_id, {"classification": {"profile": "Strategic Planner"}}))
+
+    # Round trips as the routes make them: /learn reads the profile and
+    # creates the chat in one write; a /chat turn rewrites the transcript under
+    # an update_time precondition, reading it first only on a chat cache miss.
+    rounds = 50
+    messages = [{"role": "user", "content": "Learn about: bench"}, {"role": "ai", "content": "x" * 4000}]
+    turn = [{"role": "user", "content": "thanks"}, {"role": "ai", "content": "y" * 800}]
+
+    started = time.perf_counter()
+    for i in range(rounds):
+        runner.run(bench_users.get_cognitive_profile(user_id))
+        runner.run(bench_chats.create(user_id, f"chat-{i}", "bench", messages))
+    learn_ms = (time.perf_counter() - started) / rounds * 1000
+
+    started = time.perf_counter()
+    for i in range(rounds):
+        transcript, update_time = runner.run(bench_chats.get(user_id, f"chat-{i}"))
+        runner.run(bench_chats.replace_messages(user_id, f"chat-{i}", transcript + turn, update_time))
+    cold_chat_ms = (time.perf_counter() - started) / rounds * 1000
+
+    cached = {f"chat-{i}": runner.run(bench_chats.get(user_id, f"chat-{i}")) for i in range(rounds)}
+    started = time.perf_counter()
+    for chat_id, (transcript, update_time) in cached.items():
+        runner.run(bench_chats.replace_messages(user_id, chat_id, transcript + turn, update_time))
+    warm_chat_ms = (time.perf_counter() - started) / rounds * 1000
+
+    print(f"/learn: {learn_ms:.1f} ms, /chat turn on a cache miss: {cold_chat_ms:.1f} ms, "
+          f"on a cache hit: {warm_chat_ms:.1f} ms")
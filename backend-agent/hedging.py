@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def _rounded(seconds):
+    return None if seconds is None else round(seconds, 4)
+
+
+class _RouteWindow:
+    def __init__(self, size):
+        self.primary = deque(maxlen=size)
+        self.served = deque(maxlen=size)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.losers_cancelled = 0
+
+
+class Hedger:
+    """Hedged requests for slow, idempotent calls such as LLM completions.
+
+    The first attempt runs on a worker thread. If it has not finished by the
+    route's deadline, an identical second attempt is started, and the first
+    of the two to finish wins. The deadline is the `quantile` of that route's
+    recent primary latencies, but never less than min_delay. The loser is
+    cancelled if it has not started yet; otherwise it is left to finish and
+    its result is dropped.
+
+    Hedges are paid for from a token bucket. Every call adds `budget` tokens
+    and each hedge spends one, so hedges stay at about budget x calls. The
+    bucket also caps bursts, for example when the upstream is slow for
+    everyone.
+    """
+
+    def __init__(self, routes, quantile=0.95, budget=0.1, min_samples=20, min_delay=0.5,
+                 window=200, max_workers=32):
+        self.routes = set(routes)
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._tokens = 1.0
+        self._max_tokens = max(1.0, budget * 100)
+
+    def _route(self, route):
+        window = self._windows.get(route)
+        if window is None:
+            window = self._windows[route] = _RouteWindow(self.window)
+        return window
+
+    def deadline(self, route):
+        """Seconds to wait before hedging, or None while there are too few samples"""
+        with self._lock:
+            samples = list(self._route(route).primary)
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(samples, self.quantile))
+
+    def _take_token(self, window):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                window.hedges += 1
+                return True
+            window.budget_denied += 1
+            return False
+
+    def call(self, route, attempt):
+        """Return attempt()'s result, hedging it with a second attempt() if it is slow"""
+        with self._lock:
+            window = self._route(route)
+            window.calls += 1
+            self._tokens = min(self._max_tokens, self._tokens + self.budget)
+        delay = self.deadline(route)
+        started = time.perf_counter()
+
+        def record_primary(future):
+            if future.exception() is None:
+                with self._lock:
+                    window.primary.append(time.perf_counter() - started)
+
+        primary = self._pool.submit(attempt)
+        primary.add_done_callback(record_primary)
+        pending = {primary}
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay)
+            if not done and self._take_token(window):
+                pending.add(self._pool.submit(attempt))
+
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is not None or not pending:
+                break
+        for loser in pending:
+            if loser.cancel():
+                with self._lock:
+                    window.losers_cancelled += 1
+
+        with self._lock:
+            window.served.append(time.perf_counter() - started)
+            if winner is not None and winner is not primary:
+                window.hedge_wins += 1
+        if winner is None:
+            return next(iter(done)).result()
+        return winner.result()
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for route, window in self._windows.items():
+                primary_p99 = percentile(window.primary, 0.99)
+                served_p99 = percentile(window.served, 0.99)
+                stats[route] = {
+                    "calls": window.calls,
+                    "hedges": window.hedges,
+                    "hedge_rate": round(window.hedges / window.calls, 3) if window.calls else 0.0,
+                    "hedge_wins": window.hedge_wins,
+                    "budget_denied": window.budget_denied,
+                    "losers_cancelled": window.losers_cancelled,
+                    "primary_p50_s": _rounded(percentile(window.primary, 0.5)),
+                    "primary_p99_s": _rounded(primary_p99),
+                    "served_p50_s": _rounded(percentile(window.served, 0.5)),
+                    "served_p99_s": _rounded(served_p99),
+                    "p99_improvement": round(1 - served_p99 / primary_p99, 3)
+                    if primary_p99 and served_p99 is not None else None
+                }
+            return stats
+
+
+def hedger_from_env():
+    """The hedger configured by LLM_HEDGING_* variables, or None unless LLM_HEDGING is on"""
+    if os.getenv("LLM_HEDGING", "").lower() not in ("1", "true", "yes", "on"):
+        return None
+    return Hedger(
+        [route.strip() for route in os.getenv("LLM_HEDGING_ROUTES", "/chat,/next-question").split(",")],
+        quantile=float(os.getenv("LLM_HEDGING_QUANTILE", "0.95")),
+        budget=float(os.getenv("LLM_HEDGING_BUDGET", "0.1")),
+        min_samples=int(os.getenv("LLM_HEDGING_MIN_SAMPLES", "20")),
+        min_delay=float(os.getenv("LLM_HEDGING_MIN_DELAY_SECONDS", "0.5"))
+    )
+
+
+hedger = hedger_from_env()
+
+
+if __name__ == "__main__":
+    # Stub LLM with Pareto-distributed latency: most calls are fast, a few are
+    # very slow. Compare p50/p99 with and without hedging at a 10% budget.
+    import random
+
+    random.seed(3)
+
+    def stub_llm():
+        time.sleep(min(0.02 * random.paretovariate(1.6), 3.0))
+        return "ok"
+
+    def run(hedger_or_none, calls=600, clients=8):
+        latencies = []
+
+        def one_call(_):
+            started = time.perf_counter()
+            if hedger_or_none is None:
+                stub_llm()
+            else:
+                hedger_or_none.call("/chat", stub_llm)
+            latencies.append(time.perf_counter() - started)
+
+        with ThreadPoolExecutor(max_workers=clients) as clients_pool:
+            list(clients_pool.map(one_call, range(calls)))
+        return latencies
+
+    baseline = run(None)
+    demo = Hedger(["/chat"], quantile=0.9, budget=0.1, min_samples=20, min_delay=0.0)
+    hedged = run(demo)
+    for name, latencies in (("no hedging", baseline), ("hedging", hedged)):
+        print(f"{name:11} p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  max {max(latencies) * 1000:7.1f} ms")
+    print(demo.stats()["/chat"])
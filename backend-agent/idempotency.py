@@ -0,0 +1,151 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, make_response, request
+
+
+class _Entry:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+        self.expires = None
+
+
+class IdempotencyStore:
+    """Bounded store of responses for requests sent with an Idempotency-Key.
+
+    The first request for a key runs the handler. A retry that arrives while
+    it is still running waits up to wait_timeout seconds (short, so it doesn't
+    hold an admission slot) and otherwise gets 409 with Retry-After; a retry
+    after it finished gets the stored response without re-running the LLM
+    call or repeating its Firestore writes. Only successful and 4xx responses
+    are stored; after a 5xx, a 429 or an exception the key is released so a
+    retry can try again.
+
+    Running requests are tracked apart from finished ones, whose count is
+    bounded by max_entries; running ones are bounded by the server's
+    concurrency. Finished entries are kept in finish order, so eviction only
+    looks at the front.
+    """
+
+    def __init__(self, max_entries=4096, ttl_seconds=24 * 3600, wait_timeout=2.0, retry_after=5):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._running = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.attached = 0
+
+    def _evict(self, now):
+        """Drop finished entries from the front while expired or over the bound; caller holds the lock"""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires >= now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def begin(self, key, fingerprint):
+        """Return (entry, is_owner); the owner must call finish() or abandon()"""
+        with self._lock:
+            entry = self._running.get(key)
+            if entry is not None:
+                self.attached += 1
+                return entry, False
+            now = time.monotonic()
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires >= now:
+                self.replays += 1
+                return entry, False
+            self._entries.pop(key, None)
+            entry = self._running[key] = _Entry(fingerprint)
+            return entry, True
+
+    def finish(self, key, entry, response):
+        with self._lock:
+            entry.response = response
+            entry.expires = time.monotonic() + self.ttl_seconds
+            if self._running.get(key) is entry:
+                del self._running[key]
+                self._entries[key] = entry
+                self._evict(time.monotonic())
+        entry.done.set()
+
+    def abandon(self, key, entry):
+        with self._lock:
+            if self._running.get(key) is entry:
+                del self._running[key]
+        entry.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "in_flight": len(self._running),
+                "replays": self.replays,
+                "attached_to_in_flight": self.attached
+            }
+
+
+idempotency_store = IdempotencyStore(
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "4096")),
+    ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600))),
+    wait_timeout=float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "2"))
+)
+
+
+def _request_fingerprint():
+    return hashlib.sha256(request.get_data() + request.query_string).hexdigest()
+
+
+def idempotent(view):
+    """Dedupe retries of a route that carry the same Idempotency-Key header"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        client_key = request.headers.get("Idempotency-Key")
+        if not client_key:
+            return view(*args, **kwargs)
+
+        key = f"{request.method} {request.path} {client_key}"
+        fingerprint = _request_fingerprint()
+        while True:
+            entry, is_owner = idempotency_store.begin(key, fingerprint)
+            if entry.fingerprint != fingerprint:
+                return jsonify({"error": "Idempotency-Key was already used with a different request"}), 422
+            if is_owner:
+                break
+            if not entry.done.wait(idempotency_store.wait_timeout):
+                response = jsonify({"error": "Original request with this Idempotency-Key is still running"})
+                response.status_code = 409
+                response.headers["Retry-After"] = str(idempotency_store.retry_after)
+                return response
+            if entry.response is not None:
+                body, status, headers = entry.response
+                response = current_app.response_class(body, status=status, headers=headers)
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+            # The first attempt failed and released the key; run it ourselves
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.abandon(key, entry)
+            raise
+        if response.status_code >= 500 or response.status_code == 429:
+            idempotency_store.abandon(key, entry)
+        else:
+            headers = [(name, value) for name, value in response.headers.items()
+                       if name.lower() not in ("content-length", "date")]
+            idempotency_store.finish(key, entry, (response.get_data(), response.status_code, headers))
+        return response
+
+    return wrapper
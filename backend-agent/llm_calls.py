@@ -0,0 +1,41 @@
+import time
+
+import hedging
+import llm_cassette
+from prompt_templates import estimate_tokens
+from usage_accounting import usage_accountant
+
+
+def kickoff_crew(crew, route, user_id=None, model=None, prompt_text=""):
+    """Run a crew and account the tokens it used against user_id and route.
+
+    Token counts come from the crew's usage metrics when CrewAI reports them,
+    otherwise they are estimated from the prompt and the output text. In
+    cassette replay mode the recorded output is returned instead of calling
+    the model. With LLM_HEDGING on, calls from the hedged routes go through
+    hedging.hedger.
+    """
+    if llm_cassette.cassette is not None and llm_cassette.cassette.mode == "replay":
+        output, prompt_tokens, completion_tokens = llm_cassette.replay_llm_call(route, prompt_text)
+        usage_accountant.record(user_id, route, model or "unknown", prompt_tokens, completion_tokens)
+        return output
+
+    def attempt(crew_to_run):
+        result = crew_to_run.kickoff()
+        usage = getattr(result, "token_usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or estimate_tokens(prompt_text)
+        completion_tokens = getattr(usage, "completion_tokens", 0) or estimate_tokens(str(result))
+        # Every attempt is accounted, including a hedge that lost the race
+        usage_accountant.record(user_id, route, model or "unknown", prompt_tokens, completion_tokens)
+        return result, prompt_tokens, completion_tokens
+
+    started = time.perf_counter()
+    if hedging.hedger is not None and route in hedging.hedger.routes:
+        # A Crew can't run twice at once, so each attempt kicks off its own copy
+        result, prompt_tokens, completion_tokens = hedging.hedger.call(route, lambda: attempt(crew.copy()))
+    else:
+        result, prompt_tokens, completion_tokens = attempt(crew)
+    latency = time.perf_counter() - started
+
+    llm_cassette.record_llm_call(route, prompt_text, str(result), latency, prompt_tokens, completion_tokens)
+    return result
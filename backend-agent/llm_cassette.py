@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from prompt_templates import estimate_tokens
+
+# LLM_CASSETTE_MODE=record captures every LLM call (and the HTTP requests that
+# triggered it) to LLM_CASSETTE_PATH; replay serves the recorded outputs
+# instead of calling the model, sleeping for the recorded latency times
+# LLM_REPLAY_LATENCY_SCALE.
+CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")
+CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+
+
+def prompt_key(route, prompt_text):
+    return hashlib.sha256(f"{route}\n{prompt_text}".encode()).hexdigest()
+
+
+class Cassette:
+    """JSONL file of recorded LLM calls and HTTP requests"""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._by_key = defaultdict(deque)
+        self._by_route = defaultdict(deque)
+        if mode == "replay":
+            for entry in self.entries("llm"):
+                self._by_key[entry["key"]].append(entry)
+                self._by_route[entry["route"]].append(entry)
+
+    def entries(self, entry_type):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [entry for entry in map(json.loads, filter(str.strip, f)) if entry["type"] == entry_type]
+
+    def append(self, entry):
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def next_llm_entry(self, route, prompt_text):
+        """Recorded call for this prompt, or the next one for the route if the prompt changed"""
+        with self._lock:
+            matches = self._by_key.get(prompt_key(route, prompt_text))
+            if matches:
+                entry = matches.popleft()
+                self._by_route[route].remove(entry)
+                return entry, True
+            if self._by_route[route]:
+                entry = self._by_route[route].popleft()
+                self._by_key[entry["key"]].remove(entry)
+                return entry, False
+        raise LookupError(f"No recorded LLM call left for route {route}")
+
+
+class HarnessMetrics:
+    """Per-route prompt size and parse outcomes, read by perf_regression.py"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.prompt_tokens = defaultdict(list)
+            self.parse_results = defaultdict(list)
+            self.prompt_changes = defaultdict(int)
+
+    def record_call(self, route, prompt_text, prompt_matched=True):
+        with self._lock:
+            self.prompt_tokens[route].append(estimate_tokens(prompt_text))
+            if not prompt_matched:
+                self.prompt_changes[route] += 1
+
+    def record_parse(self, route, ok):
+        with self._lock:
+            self.parse_results[route].append(bool(ok))
+
+    def snapshot(self):
+        with self._lock:
+            routes = set(self.prompt_tokens) | set(self.parse_results)
+            return {
+                route: {
+                    "llm_calls": len(self.prompt_tokens[route]),
+                    "avg_prompt_tokens": (sum(self.prompt_tokens[route]) / len(self.prompt_tokens[route])
+                                          if self.prompt_tokens[route] else 0),
+                    "parse_success_rate": (sum(self.parse_results[route]) / len(self.parse_results[route])
+                                           if self.parse_results[route] else None),
+                    "prompt_changes": self.prompt_changes[route]
+                }
+                for route in routes
+            }
+
+
+cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE) if CASSETTE_MODE in ("record", "replay") else None
+harness_metrics = HarnessMetrics()
+
+
+def note_parse(route, ok):
+    """Record whether an LLM response for route could be parsed as expected"""
+    # Samples are only kept for a record/replay session; a live service
+    # would otherwise grow these lists with every call
+    if cassette is not None:
+        harness_metrics.record_parse(route, ok)
+
+
+def replay_llm_call(route, prompt_text):
+    """Serve a recorded LLM call; returns (output, prompt_tokens, completion_tokens)"""
+    entry, matched = cassette.next_llm_entry(route, prompt_text)
+    harness_metrics.record_call(route, prompt_text, matched)
+    time.sleep(entry["latency_s"] * REPLAY_LATENCY_SCALE)
+    return entry["output"], entry["prompt_tokens"], entry["completion_tokens"]
+
+
+def record_llm_call(route, prompt_text, output, latency, prompt_tokens, completion_tokens):
+    if cassette is None:
+        return
+    harness_metrics.record_call(route, prompt_text)
+    if cassette.mode == "record":
+        cassette.append({
+            "type": "llm",
+            "route": route,
+            "key": prompt_key(route, prompt_text),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_s": round(latency, 4),
+            "output": output
+        })
+
+
+def install_http_recorder(app):
+    """In record mode, also capture the requests that drive the LLM calls"""
+    if cassette is None or cassette.mode != "record":
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_recording():
+        g.cassette_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        cassette.append({
+            "type": "http",
+            "method": request.method,
+            "path": request.path,
+            "query": request.args.to_dict(),
+            "json": request.get_json(silent=True),
+            "status": response.status_code,
+            "latency_s": round(time.perf_counter() - g.cassette_started, 4)
+        })
+        return response
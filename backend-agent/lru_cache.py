@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by entry count and, optionally, total bytes.
+
+    sizeof(value) gives the byte cost of an entry; without it only the entry
+    count is bounded.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def peek(self, key, default=None):
+        """Like get, without touching recency or the hit/miss counters"""
+        with self._lock:
+            return self._data.get(key, default)
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._sizes[key]
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._sizes[key] = size
+            self.bytes += size
+            while self._data and (len(self._data) > self.max_entries or
+                                  (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                evicted, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.bytes -= self._sizes.pop(key)
+            return self._data.pop(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions
+            }
+
+
+if __name__ == "__main__":
+    # Compare the session cookie payload before and after dropping the context
+    # from it; /chat reads the transcript from the chat cache instead. Flask
+    # serializes the session as compact JSON, compresses it with zlib when
+    # that is smaller, then base64-encodes and signs it.
+    import base64
+    import json
+    import random
+    import zlib
+
+    def cookie_bytes(session):
+        payload = json.dumps(session, separators=(",", ":")).encode()
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload) - 1:
+            payload = b"." + compressed
+        return len(base64.urlsafe_b64encode(payload)) + 40  # timestamp and signature
+
+    # Random words compress about as poorly as a real LLM explanation
+    random.seed(7)
+    vocabulary = [("".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(2, 10))))
+                  for _ in range(5000)]
+    explanation = " ".join(random.choice(vocabulary) for _ in range(1200))
+    chat_id = "Jx1Pq0ZkL4n8bT2sVw9e"
+    before = cookie_bytes({"user_id": "uid-1234567890", "chat_id": chat_id, "context": explanation})
+    after = cookie_bytes({"chat_id": chat_id})
+    print(f"explanation: {len(explanation)} chars")
+    print(f"cookie before: {before} bytes, after: {after} bytes, saved per request: {before - after} bytes")
+
@@ -0,0 +1,114 @@
+"""Replay a recorded cassette through a Flask app and compare against a baseline.
+
+Record a cassette by running a service with LLM_CASSETTE_MODE=record and
+exercising it (e.g. from the app), then:
+
+    python perf_regression.py content_flask --cassette learn.jsonl --baseline baselines/content.json --update-baseline
+    python perf_regression.py content_flask --cassette learn.jsonl --baseline baselines/content.json
+
+The second run exits non-zero if any route's average prompt tokens or p50
+handler latency grew, or its parse success rate dropped, by more than the
+tolerance. It also fails if any replayed request got a different status than
+recorded, or a route made fewer LLM calls than the baseline, so a change that
+errors out before reaching the LLM can't pass as "faster". Firestore calls are
+not replayed; point the app at the emulator with FIRESTORE_EMULATOR_HOST,
+seeded with the users and chats the recording used.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def run_replay(app_module, cassette_path, latency_scale):
+    # Cassette mode is read at import time, so configure it before loading the app
+    os.environ["LLM_CASSETTE_MODE"] = "replay"
+    os.environ["LLM_CASSETTE_PATH"] = cassette_path
+    os.environ["LLM_REPLAY_LATENCY_SCALE"] = str(latency_scale)
+    import llm_cassette
+    module = importlib.import_module(app_module)
+    client = module.app.test_client()
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(list)
+    for request in llm_cassette.cassette.entries("http"):
+        started = time.perf_counter()
+        response = client.open(request["path"], method=request["method"],
+                               query_string=request["query"], json=request["json"])
+        latencies[request["path"]].append(time.perf_counter() - started)
+        statuses[request["path"]].append(response.status_code == request["status"])
+
+    results = llm_cassette.harness_metrics.snapshot()
+    for route, samples in latencies.items():
+        route_result = results.setdefault(route, {"llm_calls": 0, "avg_prompt_tokens": 0,
+                                                  "parse_success_rate": None, "prompt_changes": 0})
+        route_result["requests"] = len(samples)
+        route_result["p50_latency_ms"] = round(percentile(samples, 0.50) * 1000, 1)
+        route_result["p95_latency_ms"] = round(percentile(samples, 0.95) * 1000, 1)
+        route_result["status_match_rate"] = sum(statuses[route]) / len(statuses[route])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions"""
+    regressions = []
+    for route, expected in baseline.items():
+        actual = results.get(route)
+        if actual is None:
+            regressions.append(f"{route}: no requests replayed")
+            continue
+        if actual.get("status_match_rate") is not None and actual["status_match_rate"] < 1:
+            regressions.append(f"{route}: only {actual['status_match_rate']:.0%} of responses had the recorded status")
+        if actual["llm_calls"] < expected.get("llm_calls", 0):
+            regressions.append(f"{route}: llm_calls {expected['llm_calls']} -> {actual['llm_calls']}")
+        for metric in ("avg_prompt_tokens", "p50_latency_ms"):
+            if expected.get(metric) and actual.get(metric) is not None and \
+                    actual[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(f"{route}: {metric} {expected[metric]} -> {actual[metric]}")
+        if expected.get("parse_success_rate") is not None and actual.get("parse_success_rate") is not None and \
+                actual["parse_success_rate"] < expected["parse_success_rate"] - tolerance:
+            regressions.append(f"{route}: parse_success_rate {expected['parse_success_rate']:.2f} -> "
+                               f"{actual['parse_success_rate']:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app_module", help="e.g. content_flask or assessment_classifier_flask")
+    parser.add_argument("--cassette", required=True)
+    parser.add_argument("--baseline", required=True)
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run_replay(args.app_module, args.cassette, args.latency_scale)
+    print(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Pre-generate /learn explanations for popular concepts.
+
+Fills the content store for every concept x profile x format x difficulty
+cell that has no entry for the current prompt version, so /learn can serve
+those cells without an LLM call:
+
+    python pregenerate.py --concepts-file popular_concepts.txt
+    python pregenerate.py --from-firestore 50 --rate 20
+
+Concepts come from a file (one per line, e.g. extracted from logs) and/or the
+most common chat titles in Firestore. Generation is paced to --rate LLM
+calls per minute. Rerun after any prompt change; stale cells are regenerated.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+import content_flask
+from content_flask import (
+    COGNITIVE_PROFILES, DIFFICULTY_LEVELS, FORMAT_GUIDANCE, LEARN_PROMPT_VERSION, generate_explanation
+)
+from content_store import content_store, normalize
+from firestore_repo import runner, chats
+
+
+def load_concepts(args):
+    concepts = []
+    if args.concepts_file:
+        with open(args.concepts_file) as f:
+            concepts.extend(line.strip() for line in f if line.strip())
+    if args.from_firestore:
+        content_flask.initialize_firebase()
+        counts = Counter(normalize(title) for title in runner.run(chats.list_titles(), timeout=300))
+        concepts.extend(title for title, _ in counts.most_common(args.from_firestore))
+
+    unique = {}
+    for concept in concepts:
+        unique.setdefault(normalize(concept), concept)
+    return list(unique.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concepts-file")
+    parser.add_argument("--from-firestore", type=int, default=0, metavar="N",
+                        help="also use the N most common chat titles")
+    parser.add_argument("--rate", type=float, default=30, help="max LLM calls per minute")
+    args = parser.parse_args()
+
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        print("GROQ_API_KEY not set")
+        return 1
+
+    concepts = load_concepts(args)
+    cells = [
+        (concept, profile, format_pref, difficulty)
+        for concept in concepts
+        for profile in COGNITIVE_PROFILES
+        for format_pref in FORMAT_GUIDANCE
+        for difficulty in DIFFICULTY_LEVELS
+    ]
+    print(f"{len(concepts)} concepts, {len(cells)} cells, prompt version {LEARN_PROMPT_VERSION}")
+
+    interval = 60.0 / args.rate
+    next_call = 0.0
+    generated = skipped = failed = 0
+    for concept, profile, format_pref, difficulty in cells:
+        if content_store.get(concept, profile, format_pref, difficulty, LEARN_PROMPT_VERSION) is not None:
+            skipped += 1
+            continue
+
+        time.sleep(max(0.0, next_call - time.monotonic()))
+        next_call = time.monotonic() + interval
+        try:
+            text = generate_explanation(groq_api_key, concept, difficulty, format_pref, profile,
+                                        COGNITIVE_PROFILES[profile]["description"], route="pregenerate")
+        except Exception as e:
+            failed += 1
+            print(f"Failed {concept!r} / {profile} / {format_pref} / {difficulty}: {e}")
+            continue
+        content_store.put(concept, profile, format_pref, difficulty, LEARN_PROMPT_VERSION, text)
+        generated += 1
+
+    print(f"generated {generated}, already fresh {skipped}, failed {failed}")
+    print(content_store.stats(LEARN_PROMPT_VERSION))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import re
+import threading
+from string import Formatter
+from textwrap import dedent
+
+# Rough token estimate: words and punctuation runs, close enough to compare
+# prompt sizes between calls without pulling in a tokenizer.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]+")
+
+
+def estimate_tokens(text):
+    """Approximate the number of LLM tokens in a piece of text"""
+    if not text:
+        return 0
+    return len(_TOKEN_RE.findall(text))
+
+
+class PromptTemplate:
+    """A prompt split into a static prefix and a variable body.
+
+    The static part is dedented and measured once at import time and is never
+    passed through str.format, so literal braces (JSON schemas) need no
+    escaping. Keeping it first and byte-identical across calls lets providers
+    reuse their prompt-prefix cache; only the body is rendered per request.
+    """
+
+    def __init__(self, name, static, dynamic=""):
+        self.name = name
+        self.static = dedent(static).strip()
+        self.dynamic = dedent(dynamic).strip()
+        self.fields = sorted({field for _, field, _, _ in Formatter().parse(self.dynamic) if field})
+        self.static_tokens = estimate_tokens(self.static)
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.dynamic_tokens_total = 0
+        self.last_dynamic_tokens = 0
+
+    def render(self, **values):
+        body = self.dynamic.format(**values) if self.dynamic else ""
+        dynamic_tokens = estimate_tokens(body)
+        with self._lock:
+            self.renders += 1
+            self.dynamic_tokens_total += dynamic_tokens
+            self.last_dynamic_tokens = dynamic_tokens
+        if not body:
+            return self.static
+        return f"{self.static}\n\n{body}"
+
+    def stats(self):
+        with self._lock:
+            renders = self.renders
+            avg_dynamic = self.dynamic_tokens_total / renders if renders else 0
+            return {
+                "renders": renders,
+                "static_tokens": self.static_tokens,
+                "avg_dynamic_tokens": round(avg_dynamic, 1),
+                "last_dynamic_tokens": self.last_dynamic_tokens,
+                "avg_total_tokens": round(self.static_tokens + avg_dynamic, 1),
+            }
+
+
+_templates = {}
+
+
+def register_template(name, static, dynamic=""):
+    """Compile a template once and make it available by name"""
+    template = PromptTemplate(name, static, dynamic)
+    _templates[name] = template
+    return template
+
+
+def get_template(name):
+    return _templates[name]
+
+
+def template_stats():
+    """Per-template token counts, for logging and the /prompt-stats routes"""
+    return {name: template.stats() for name, template in _templates.items()}
@@ -0,0 +1,157 @@
+import math
+import re
+from collections import Counter
+
+# Curated follow-up questions indexed by the cognitive dimensions in
+# assessment_prompt. Keywords describe what an answer touching on the
+# dimension tends to mention and are matched against the previous answer.
+QUESTION_BANK = {
+    "working_memory": [
+        {
+            "question": "When you are following several steps at once, such as instructions or a recipe, how do you keep track of where you are without losing details?",
+            "keywords": "steps instructions remember track details notes forget recipe follow list"
+        },
+        {
+            "question": "You mentioned how you take in new material. How much of it can you usually hold in your head before you need to write it down or look it up again?",
+            "keywords": "read notes write memorize remember recall information material hold head"
+        },
+        {
+            "question": "When someone explains a multi-part idea out loud, what do you do to keep the earlier parts in mind while listening to the rest?",
+            "keywords": "listen explain lecture talk conversation remember parts follow along"
+        }
+    ],
+    "attention_control": [
+        {
+            "question": "When you are studying or working on something new, what usually pulls your focus away, and how do you bring yourself back?",
+            "keywords": "focus distracted distraction concentrate phone noise attention interrupt study"
+        },
+        {
+            "question": "How long can you usually stay fully concentrated on one task before you need a break, and what does that break look like?",
+            "keywords": "break hours time long concentrate session pomodoro tired focus"
+        },
+        {
+            "question": "Do you prefer working in silence, with background sound, or around other people, and how does your environment change how well you focus?",
+            "keywords": "music quiet silence environment people library cafe noise background"
+        }
+    ],
+    "learning_style": [
+        {
+            "question": "When you pick up something new, do diagrams and videos, spoken explanations, or trying it yourself help you understand it fastest?",
+            "keywords": "video diagram visual watch listen podcast hands practice try doing"
+        },
+        {
+            "question": "Think of something you learned well recently. Did it click while reading about it, hearing it explained, or physically working through it?",
+            "keywords": "read book article explained teacher tutorial practice project built learned"
+        },
+        {
+            "question": "If you had to learn to use an unfamiliar tool today, would you start with the manual, a walkthrough video, or by experimenting with it directly?",
+            "keywords": "tool manual documentation video experiment try explore tutorial guide"
+        }
+    ],
+    "planning_orientation": [
+        {
+            "question": "Before you start learning a new topic, do you lay out a plan or schedule, or do you dive in and adjust as you go?",
+            "keywords": "plan schedule goals organize structure roadmap dive start adjust"
+        },
+        {
+            "question": "When a project has a deadline several weeks away, how do you break the work down and decide what to do first?",
+            "keywords": "deadline project weeks break down prioritize first tasks organize"
+        },
+        {
+            "question": "What tools or habits, such as lists, calendars or outlines, do you rely on to keep your learning organized over time?",
+            "keywords": "list calendar outline notes organize habit routine track progress"
+        }
+    ],
+    "decision_making": [
+        {
+            "question": "When you have to choose between two approaches to a problem, do you go with your gut feeling or compare the options carefully first?",
+            "keywords": "choose decide decision gut intuition compare options analyze"
+        },
+        {
+            "question": "Can you describe a recent decision about how to learn or study something, and what information you weighed before making it?",
+            "keywords": "decision chose weighed information research pros cons reasons"
+        },
+        {
+            "question": "When your first idea for solving a problem turns out to be wrong, how do you decide what to try next?",
+            "keywords": "wrong mistake problem solve try next trial error debug approach"
+        }
+    ]
+}
+
+DIMENSIONS = list(QUESTION_BANK.keys())
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "does", "for",
+    "from", "how", "i", "if", "in", "is", "it", "its", "me", "my", "of", "on",
+    "or", "so", "that", "the", "then", "this", "to", "usually", "was", "what",
+    "when", "with", "you", "your", "like", "just", "really", "very", "about"
+}
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed"""
+    return [word for word in _WORD_RE.findall((text or "").lower()) if word not in STOPWORDS]
+
+
+def _cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(weight * b[word] for word, weight in a.items() if word in b)
+    if not dot:
+        return 0.0
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+class QuestionBank:
+    """Pre-generated follow-up questions with a TF-IDF selector.
+
+    Entry vectors and IDF weights are computed once at construction, so
+    selecting a question for an answer is a few dictionary lookups per
+    candidate and runs in well under a millisecond.
+    """
+
+    def __init__(self, bank=QUESTION_BANK):
+        documents = []
+        for dimension, questions in bank.items():
+            for item in questions:
+                documents.append((dimension, item["question"], Counter(tokenize(item["question"] + " " + item["keywords"]))))
+
+        document_frequency = Counter()
+        for _, _, terms in documents:
+            document_frequency.update(terms.keys())
+        total = len(documents)
+        self.idf = {word: math.log((total + 1) / (df + 1)) + 1 for word, df in document_frequency.items()}
+
+        self.entries = [
+            {"dimension": dimension, "question": question, "vector": self._weigh(terms)}
+            for dimension, question, terms in documents
+        ]
+        self._dimensions = {entry["question"]: entry["dimension"] for entry in self.entries}
+
+    def _weigh(self, terms):
+        return {word: count * self.idf[word] for word, count in terms.items() if word in self.idf}
+
+    def select(self, previous_answer, asked_questions=(), asked_dimensions=()):
+        """Pick the best unasked question for the previous answer.
+
+        Dimensions that have not been probed yet are preferred; the score is
+        the TF-IDF cosine similarity with the answer. Returns
+        (question, dimension, score) or None when the bank is exhausted.
+        """
+        answer_vector = self._weigh(Counter(tokenize(previous_answer)))
+        asked = set(asked_questions)
+        candidates = [e for e in self.entries if e["question"] not in asked]
+        if not candidates:
+            return None
+
+        asked_dimensions = set(asked_dimensions)
+        fresh = [e for e in candidates if e["dimension"] not in asked_dimensions]
+        scored = [(_cosine(answer_vector, e["vector"]), e) for e in (fresh or candidates)]
+        score, best = max(scored, key=lambda pair: pair[0])
+        return best["question"], best["dimension"], score
+
+    def dimension_of(self, question):
+        return self._dimensions.get(question)
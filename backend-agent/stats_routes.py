@@ -0,0 +1,31 @@
+from flask import jsonify
+
+from hedging import hedger
+from idempotency import idempotency_store
+from prompt_templates import template_stats
+
+
+def hedging_stats():
+    if hedger is None:
+        return {"enabled": False}
+    return {"enabled": True, "routes": hedger.stats()}
+
+
+def install_stats_routes(app, admission, compressor, extra=None):
+    """Register the read-only GET /<name>-stats routes both services expose.
+
+    /prompt-stats, /admission-stats, /idempotency-stats, /compression-stats
+    and /hedging-stats are common to both apps; extra maps further paths to
+    zero-argument functions returning a JSON-serializable dict.
+    """
+    providers = {
+        "/prompt-stats": template_stats,
+        "/admission-stats": admission.stats,
+        "/idempotency-stats": idempotency_store.stats,
+        "/compression-stats": compressor.stats,
+        "/hedging-stats": hedging_stats,
+    }
+    providers.update(extra or {})
+    for path, provider in providers.items():
+        endpoint = path.strip("/").replace("-", "_")
+        app.add_url_rule(path, endpoint, lambda provider=provider: jsonify(provider()), methods=["GET"])
@@ -0,0 +1,92 @@
+import threading
+
+from flask import Flask, jsonify
+
+import idempotency
+from idempotency import IdempotencyStore, idempotent
+
+
+def test_store_stays_bounded_behind_a_hung_request():
+    store = IdempotencyStore(max_entries=3)
+    hung, is_owner = store.begin("hung", "fp")
+    assert is_owner
+
+    for i in range(50):
+        entry, _ = store.begin(f"key-{i}", "fp")
+        store.finish(f"key-{i}", entry, (b"ok", 200, []))
+
+    stats = store.stats()
+    assert stats["entries"] == 3
+    assert stats["in_flight"] == 1
+    # The newest finished keys are kept, the oldest were evicted
+    assert not store.begin("key-49", "fp")[1]
+    assert store.begin("key-0", "fp")[1]
+
+    store.finish("hung", hung, (b"late", 200, []))
+    assert store.stats()["entries"] == 3
+    assert not store.begin("hung", "fp")[1]
+
+
+def test_expired_entry_is_run_again():
+    store = IdempotencyStore(ttl_seconds=-1)
+    entry, _ = store.begin("key", "fp")
+    store.finish("key", entry, (b"ok", 200, []))
+    assert store.begin("key", "fp")[1]
+
+
+def test_abandoned_key_can_be_retried():
+    store = IdempotencyStore()
+    entry, _ = store.begin("key", "fp")
+    store.abandon("key", entry)
+    assert entry.done.is_set()
+    assert store.begin("key", "fp")[1]
+    assert store.stats()["entries"] == 0
+
+
+def _app(monkeypatch, store, handler):
+    monkeypatch.setattr(idempotency, "idempotency_store", store)
+    app = Flask(__name__)
+    app.add_url_rule("/learn", "learn", idempotent(handler), methods=["POST"])
+    return app.test_client()
+
+
+def test_retry_replays_the_stored_response(monkeypatch):
+    calls = []
+
+    def learn():
+        calls.append(1)
+        return jsonify({"chat_id": f"chat-{len(calls)}"})
+
+    client = _app(monkeypatch, IdempotencyStore(), learn)
+    headers = {"Idempotency-Key": "k1"}
+    first = client.post("/learn", json={"concept": "Recursion"}, headers=headers)
+    retry = client.post("/learn", json={"concept": "Recursion"}, headers=headers)
+
+    assert len(calls) == 1
+    assert retry.get_json() == first.get_json() == {"chat_id": "chat-1"}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+    other = client.post("/learn", json={"concept": "Graphs"}, headers=headers)
+    assert other.status_code == 422
+
+
+def test_retry_while_running_gets_409_with_retry_after(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def learn():
+        started.set()
+        release.wait(5)
+        return jsonify({"chat_id": "chat-1"})
+
+    client = _app(monkeypatch, IdempotencyStore(wait_timeout=0.05, retry_after=7), learn)
+    headers = {"Idempotency-Key": "k1"}
+    first = threading.Thread(target=client.post, args=("/learn",), kwargs={"json": {}, "headers": headers})
+    first.start()
+    started.wait(5)
+    try:
+        retry = client.post("/learn", json={}, headers=headers)
+        assert retry.status_code == 409
+        assert retry.headers["Retry-After"] == "7"
+    finally:
+        release.set()
+        first.join()
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class TierMetrics:
+    """Latency and quality counters for one generation tier"""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.successes = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.scored = 0
+        self.quality_total = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, outcome, latency, quality=None):
+        with self._lock:
+            self.calls += 1
+            if outcome == "ok":
+                self.successes += 1
+            elif outcome == "timeout":
+                self.timeouts += 1
+            elif outcome == "rejected":
+                self.rejected += 1
+            else:
+                self.errors += 1
+            self.latencies.append(latency)
+            if quality is not None:
+                self.scored += 1
+                self.quality_total += quality
+
+    def record_cancelled(self):
+        with self._lock:
+            self.cancelled += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self.latencies)
+            return {
+                "calls": self.calls,
+                "successes": self.successes,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "avg_quality": round(self.quality_total / self.scored, 3) if self.scored else None,
+                "p50_latency_ms": _percentile_ms(samples, 0.50),
+                "p95_latency_ms": _percentile_ms(samples, 0.95),
+            }
+
+
+def _percentile_ms(samples, q):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, int(q * len(samples)))
+    return round(samples[index] * 1000, 1)
+
+
+class TieredGenerator:
+    """Try the primary LLM within a latency budget, then fall back to local tiers.
+
+    Each tier is a (name, fn) pair. fn takes no arguments and returns a
+    (result, quality) pair or raises; result is None when it is unusable and
+    the next tier should be tried, and quality is a score between 0 and 1, or
+    None for tiers that cannot score their output (they are left out of
+    avg_quality). Only the first tier runs under the budget: the local tiers
+    are expected to be fast. A primary call that blows the budget is cancelled
+    if it is still queued in the pool; one that already started runs to the
+    end and its result is discarded.
+    """
+
+    def __init__(self, latency_budget, max_workers=8):
+        self.latency_budget = latency_budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-tier")
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def metrics(self, tier):
+        with self._metrics_lock:
+            if tier not in self._metrics:
+                self._metrics[tier] = TierMetrics()
+            return self._metrics[tier]
+
+    def generate(self, tiers):
+        """Return (result, tier_name) from the first tier that succeeds"""
+        last_error = None
+        for position, (name, fn) in enumerate(tiers):
+            started = time.perf_counter()
+            future = None
+            try:
+                if position == 0:
+                    future = self._executor.submit(fn)
+                    result, quality = future.result(timeout=self.latency_budget)
+                else:
+                    result, quality = fn()
+            except FutureTimeoutError:
+                self.metrics(name).record("timeout", time.perf_counter() - started)
+                if future.cancel():
+                    self.metrics(name).record_cancelled()
+                last_error = TimeoutError(f"{name} exceeded {self.latency_budget}s budget")
+                continue
+            except Exception as e:
+                self.metrics(name).record("error", time.perf_counter() - started)
+                last_error = e
+                continue
+
+            if result is None:
+                self.metrics(name).record("rejected", time.perf_counter() - started)
+                last_error = ValueError(f"{name} returned an unusable result")
+                continue
+            self.metrics(name).record("ok", time.perf_counter() - started, quality)
+            return result, name
+
+        raise last_error or RuntimeError("No generation tiers configured")
+
+    def stats(self):
+        with self._metrics_lock:
+            tiers = dict(self._metrics)
+        return {
+            "latency_budget_s": self.latency_budget,
+            "tiers": {name: metrics.snapshot() for name, metrics in tiers.items()}
+        }
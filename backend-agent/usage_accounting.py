@@ -0,0 +1,219 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+class QuotaExceeded(Exception):
+    """Raised where an LLM call is about to be made for a user over quota"""
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (user_id, route, model, day) -> [calls, prompt_tokens, completion_tokens], not yet flushed
+        self.pending = {}
+        # user_id -> [day, calls, tokens], what the quota check reads
+        self.user_totals = {}
+
+
+class UsageAccountant:
+    """Per-user, per-route and per-model LLM usage counters.
+
+    Counters are split across shards keyed by user_id so concurrent requests
+    for different users rarely contend on the same lock. Deltas are flushed
+    periodically to SQLite, which both services can share. Quota checks only
+    read the in-process daily totals. A user's persisted usage for the day is
+    loaded the first time they are seen and reloaded after every flush, so
+    calls made through other processes count within one flush interval.
+    """
+
+    def __init__(self, db_path, shards=16, daily_token_quota=0, daily_call_quota=0):
+        self.db_path = db_path
+        self.daily_token_quota = daily_token_quota
+        self.daily_call_quota = daily_call_quota
+        self._shards = [_Shard() for _ in range(shards)]
+        self._db_lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_usage (
+                    user_id TEXT NOT NULL,
+                    route TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    calls INTEGER NOT NULL DEFAULT 0,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, route, model, day)
+                )"""
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _shard(self, user_id):
+        return self._shards[hash(user_id) % len(self._shards)]
+
+    def _user_total(self, shard, user_id, day):
+        """Daily totals for a user; caller holds the shard lock"""
+        totals = shard.user_totals.get(user_id)
+        if totals is None or totals[0] != day:
+            calls, tokens = self._persisted_totals(user_id, day)
+            totals = shard.user_totals[user_id] = [day, calls, tokens]
+        return totals
+
+    def _persisted_totals(self, user_id, day):
+        try:
+            with self._db_lock, self._connect() as conn:
+                row = conn.execute(
+                    "SELECT COALESCE(SUM(calls), 0), COALESCE(SUM(prompt_tokens + completion_tokens), 0) "
+                    "FROM llm_usage WHERE user_id = ? AND day = ?",
+                    (user_id, day)
+                ).fetchone()
+            return row[0], row[1]
+        except sqlite3.Error as e:
+            logger.error(f"Could not load persisted usage for {user_id}: {e}")
+            return 0, 0
+
+    def record(self, user_id, route, model, prompt_tokens, completion_tokens):
+        user_id = user_id or "anonymous"
+        day = _today()
+        shard = self._shard(user_id)
+        with shard.lock:
+            counters = shard.pending.setdefault((user_id, route, model, day), [0, 0, 0])
+            counters[0] += 1
+            counters[1] += prompt_tokens
+            counters[2] += completion_tokens
+            totals = self._user_total(shard, user_id, day)
+            totals[1] += 1
+            totals[2] += prompt_tokens + completion_tokens
+
+    def check_quota(self, user_id):
+        """Return None if the user may make another LLM call, else a reason"""
+        if not user_id or not (self.daily_token_quota or self.daily_call_quota):
+            return None
+        shard = self._shard(user_id)
+        with shard.lock:
+            _, calls, tokens = self._user_total(shard, user_id, _today())
+        if self.daily_call_quota and calls >= self.daily_call_quota:
+            return f"Daily LLM call quota of {self.daily_call_quota} reached"
+        if self.daily_token_quota and tokens >= self.daily_token_quota:
+            return f"Daily token quota of {self.daily_token_quota} reached"
+        return None
+
+    def _refresh_totals(self):
+        """Reload today's totals of known users from SQLite, plus their unflushed deltas"""
+        day = _today()
+        try:
+            with self._db_lock, self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT user_id, SUM(calls), SUM(prompt_tokens + completion_tokens) "
+                    "FROM llm_usage WHERE day = ? GROUP BY user_id",
+                    (day,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Could not refresh persisted usage: {e}")
+            return
+        persisted = {user_id: (calls, tokens) for user_id, calls, tokens in rows}
+        for shard in self._shards:
+            with shard.lock:
+                refreshed = {}
+                for user_id, totals in shard.user_totals.items():
+                    if totals[0] != day:
+                        continue  # not seen today; reloaded on their next call
+                    calls, tokens = persisted.get(user_id, (0, 0))
+                    for (pending_user, _, _, pending_day), counters in shard.pending.items():
+                        if pending_user == user_id and pending_day == day:
+                            calls += counters[0]
+                            tokens += counters[1] + counters[2]
+                    refreshed[user_id] = [day, calls, tokens]
+                shard.user_totals = refreshed
+
+    def flush(self):
+        """Write pending deltas to SQLite, then reload the totals quota checks read"""
+        deltas = []
+        for shard in self._shards:
+            with shard.lock:
+                if shard.pending:
+                    deltas.extend((key, value) for key, value in shard.pending.items())
+                    shard.pending = {}
+        if not deltas:
+            self._refresh_totals()
+            return 0
+        try:
+            with self._db_lock, self._connect() as conn:
+                conn.executemany(
+                    """INSERT INTO llm_usage (user_id, route, model, day, calls, prompt_tokens, completion_tokens)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (user_id, route, model, day) DO UPDATE SET
+                           calls = calls + excluded.calls,
+                           prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                           completion_tokens = completion_tokens + excluded.completion_tokens""",
+                    [key + tuple(value) for key, value in deltas]
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Usage flush failed, keeping {len(deltas)} deltas for the next flush: {e}")
+            for key, value in deltas:
+                shard = self._shard(key[0])
+                with shard.lock:
+                    counters = shard.pending.setdefault(key, [0, 0, 0])
+                    for i in range(3):
+                        counters[i] += value[i]
+            return 0
+        self._refresh_totals()
+        return len(deltas)
+
+    def start_flusher(self, interval=30):
+        if self._flusher is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                self.flush()
+
+        self._flusher = threading.Thread(target=run, name="usage-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def top_consumers(self, limit=10, day=None):
+        """Users with the highest token usage, with a per-route breakdown"""
+        self.flush()
+        day = day or _today()
+        with self._db_lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT user_id, route, model, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens) "
+                "FROM llm_usage WHERE day = ? GROUP BY user_id, route, model",
+                (day,)
+            ).fetchall()
+
+        users = {}
+        for user_id, route, model, calls, prompt_tokens, completion_tokens in rows:
+            user = users.setdefault(user_id, {"user_id": user_id, "calls": 0, "tokens": 0, "routes": []})
+            user["calls"] += calls
+            user["tokens"] += prompt_tokens + completion_tokens
+            user["routes"].append({
+                "route": route,
+                "model": model,
+                "calls": calls,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens
+            })
+        ranked = sorted(users.values(), key=lambda u: u["tokens"], reverse=True)
+        return ranked[:limit]
+
+
+usage_accountant = UsageAccountant(
+    db_path=os.getenv("USAGE_DB_PATH", "llm_usage.db"),
+    daily_token_quota=int(os.getenv("USER_DAILY_TOKEN_QUOTA", "0")),
+    daily_call_quota=int(os.getenv("USER_DAILY_CALL_QUOTA", "0"))
+)
@@ -1,14 +1,56 @@
+import 'dart:async';
 import 'dart:convert';
+import 'dart:math';
 import 'package:cloud_firestore/cloud_firestore.dart';
 import 'package:cogbot/login.dart';
 import 'package:http/http.dart' as http;
 
+// LLM-backed requests can take a while; after this long the request is
+// retried once with the same Idempotency-Key, so the server returns the
+// first attempt's result instead of running it again.
+const Duration llmRequestTimeout = Duration(seconds: 60);
+
+String newIdempotencyKey() {
+  final random = Random.secure();
+  return List.generate(
+    16,
+    (_) => random.nextInt(256).toRadixString(16).padLeft(2, '0'),
+  ).join();
+}
+
+// A 409 with Retry-After means the first attempt is still running on the
+// server; poll with the same key until its stored result is returned.
+const int maxInFlightPolls = 12;
+
+Future<http.Response> sendWithRetry(
+  Future<http.Response> Function() send,
+) async {
+  http.Response response;
+  try {
+    response = await send().timeout(llmRequestTimeout);
+  } on TimeoutException {
+    response = await send().timeout(llmRequestTimeout);
+  }
+  for (var i = 0;
+      i < maxInFlightPolls &&
+          response.statusCode == 409 &&
+          response.headers.containsKey('retry-after');
+      i++) {
+    final seconds = int.tryParse(response.headers['retry-after']!) ?? 5;
+    await Future.delayed(Duration(seconds: seconds));
+    response = await send().timeout(llmRequestTimeout);
+  }
+  return response;
+}
 
 Future<String> getnextquestion() async {
   final uri = Uri.parse('http://10.0.2.2:5002/next-question?user_id=$userId');
 
   try {
-    final response = await http.get(uri);
+    final headers = {'Idempotency-Key': newIdempotencyKey()};
+    final response = await sendWithRetry(
+      () => http.get(uri, headers: headers),
+    );
 
     if (response.statusCode == 200) {
       final data = json.decode(response.body);
@@ -52,10 +94,16 @@ Future<dynamic> SubmitAnswer(String user_id, String answer) async {
   final uri = Uri.parse("http://10.0.2.2:5002/submit-response");
 
   try {
-    final response = await http.post(
-      uri,
-      headers: {'Content-Type': 'application/json'},
-      body: json.encode({"user_id": user_id, "user_response": answer}),
+    final headers = {
+      'Content-Type': 'application/json',
+      'Idempotency-Key': newIdempotencyKey(),
+    };
+    final response = await sendWithRetry(
+      () => http.post(
+        uri,
+        headers: headers,
+        body: json.encode({"user_id": user_id, "user_response": answer}),
+      ),
     );
 
     if (response.statusCode == 200) {
@@ -146,10 +194,16 @@ Future<Map<String, dynamic>> topicToLearn({
 
   try {
     // Make the POST request
-    final response = await http.post(
-      Uri.parse(apiUrl),
-      headers: {'Content-Type': 'application/json'},
-      body: jsonEncode(requestBody),
+    final headers = {
+      'Content-Type': 'application/json',
+      'Idempotency-Key': newIdempotencyKey(),
+    };
+    final response = await sendWithRetry(
+      () => http.post(
+        Uri.parse(apiUrl),
+        headers: headers,
+        body: jsonEncode(requestBody),
+      ),
     );
 
     // Check if the request was successful
@@ -187,10 +241,16 @@ Future<Map<String, dynamic>> sendFollowUpQuestion({
 
   try {
     // Make the POST request
-    final response = await http.post(
-      Uri.parse(apiUrl),
-      headers: {'Content-Type': 'application/json'},
-      body: jsonEncode(requestBody),
+    final headers = {
+      'Content-Type': 'application/json',
+      'Idempotency-Key': newIdempotencyKey(),
+    };
+    final response = await sendWithRetry(
+      () => http.post(
+        Uri.parse(apiUrl),
+        headers: headers,
+        body: jsonEncode(requestBody),
+      ),
     );
 
     // Check if the request was successful